@@ -0,0 +1,323 @@
+# metricq-wizard
+# Copyright (C) 2026 ZIH, CIDS, Technische Universitaet Dresden,
+#                    Federal Republic of Germany
+#
+# All rights reserved.
+#
+# This file is part of metricq-wizard.
+#
+# metricq-wizard is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# metricq-wizard is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with metricq-wizard.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Conditional and precompressed responses for the heavy read endpoints.
+
+A view passes the version of the data its response is built from, e.g. the
+update sequence of a database. Requests with a matching ``If-None-Match``
+get a 304 without building anything. Otherwise, the body is compressed
+while it is sent and kept per version, so the next request for the same
+version just gets the cached bytes.
+"""
+
+import hashlib
+import zlib
+from collections import OrderedDict
+from typing import AsyncIterator, Awaitable, Callable, Optional
+
+from aiohttp.web_request import Request
+from aiohttp.web_response import Response, StreamResponse
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+IDENTITY = "identity"
+GZIP = "gzip"
+BROTLI = "br"
+
+# We compress while we send, so prefer speed over the last few percent.
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+
+class ResponseBody:
+    """The content of a response, as it is produced by a view"""
+
+    def __init__(
+        self,
+        chunks: AsyncIterator[bytes],
+        content_type: str = "application/json",
+        headers: Optional[dict[str, str]] = None,
+    ):
+        self.chunks = chunks
+        self.content_type = content_type
+        self.headers = headers or {}
+
+    @classmethod
+    def from_bytes(cls, body: bytes, **kwargs) -> "ResponseBody":
+        async def chunks() -> AsyncIterator[bytes]:
+            yield body
+
+        return cls(chunks(), **kwargs)
+
+
+class _CacheEntry:
+    def __init__(self, etag: str, content_type: str, headers: dict[str, str]):
+        self.etag = etag
+        self.content_type = content_type
+        self.headers = headers
+        # encoding => encoded body
+        self.bodies: dict[str, bytes] = {}
+
+    @property
+    def size(self) -> int:
+        return sum(len(body) for body in self.bodies.values())
+
+
+class ResponseCache:
+    """
+    The encoded bodies of the latest version of each cached response.
+
+    Entries are evicted least recently used first, once there are more than
+    `max_entries` of them or they take more than `max_bytes` in total.
+    Bodies larger than a quarter of `max_bytes` are sent, but not cached.
+    """
+
+    def __init__(self, max_entries: int = 256, max_bytes: int = 64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_body_bytes = max_bytes // 4
+
+        self._entries: OrderedDict[str, _CacheEntry] = OrderedDict()
+        self._size = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def get(self, key: str, etag: str, encoding: str) -> Optional[_CacheEntry]:
+        entry = self._entries.get(key)
+        if entry is None or entry.etag != etag or encoding not in entry.bodies:
+            return None
+
+        self._entries.move_to_end(key)
+        return entry
+
+    def put(
+        self,
+        key: str,
+        etag: str,
+        encoding: str,
+        body: bytes,
+        content_type: str,
+        headers: dict[str, str],
+    ) -> None:
+        entry = self._entries.get(key)
+        if entry is None or entry.etag != etag:
+            # an entry of an older version is useless from now on
+            self._remove(key)
+            entry = _CacheEntry(etag, content_type, headers)
+            self._entries[key] = entry
+
+        self._size -= entry.size
+        entry.bodies[encoding] = body
+        self._size += entry.size
+        self._entries.move_to_end(key)
+
+        while self._entries and (
+            len(self._entries) > self.max_entries or self._size > self.max_bytes
+        ):
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._size -= entry.size
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "bytes": self._size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "not_modified": self.not_modified,
+        }
+
+
+class _Encoder:
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == GZIP:
+            self._compressor = zlib.compressobj(
+                GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS
+            )
+        elif encoding == BROTLI:
+            self._compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        else:
+            self._compressor = None
+
+    def encode(self, data: bytes) -> bytes:
+        if self.encoding == GZIP:
+            return self._compressor.compress(data)
+        if self.encoding == BROTLI:
+            return self._compressor.process(data)
+        return data
+
+    def finish(self) -> bytes:
+        if self.encoding == GZIP:
+            return self._compressor.flush()
+        if self.encoding == BROTLI:
+            return self._compressor.finish()
+        return b""
+
+
+def _accepted_encodings(request: Request) -> set[str]:
+    accepted = set()
+    for value in request.headers.get("Accept-Encoding", "").split(","):
+        coding, _, params = value.partition(";")
+        coding = coding.strip().lower()
+        params = params.replace(" ", "")
+        if params.startswith("q=") and params[2:].strip("0.") == "":
+            # q=0 means "not acceptable"
+            continue
+        if coding:
+            accepted.add(coding)
+    return accepted
+
+
+def choose_encoding(request: Request) -> str:
+    accepted = _accepted_encodings(request)
+    if brotli is not None and BROTLI in accepted:
+        return BROTLI
+    if GZIP in accepted or "*" in accepted:
+        return GZIP
+    return IDENTITY
+
+
+def make_etag(version: str, variant: str = "") -> str:
+    digest = hashlib.blake2b(f"{version}\0{variant}".encode(), digest_size=12)
+    # Weak, because the same version is sent with different encodings.
+    return f'W/"{digest.hexdigest()}"'
+
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("If-None-Match")
+    if not if_none_match:
+        return False
+
+    opaque_tag = etag.removeprefix("W/")
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag == "*" or tag.removeprefix("W/") == opaque_tag:
+            return True
+    return False
+
+
+def _cache_key(request: Request, variant: str) -> str:
+    query = "&".join(f"{key}={value}" for key, value in sorted(request.query.items()))
+    return f"{request.path}?{query}#{variant}"
+
+
+async def send_body(
+    request: Request,
+    body: ResponseBody,
+    encoding: str = IDENTITY,
+    headers: Optional[dict[str, str]] = None,
+    keep: int = 0,
+) -> tuple[StreamResponse, Optional[bytes]]:
+    """
+    Streams `body` with the given content `encoding`.
+
+    Returns the response and the encoded body, if it was no larger than
+    `keep` bytes, so the caller can cache it.
+    """
+    response = StreamResponse(headers={**body.headers, **(headers or {})})
+    response.content_type = body.content_type
+    if encoding != IDENTITY:
+        response.headers["Content-Encoding"] = encoding
+    response.enable_chunked_encoding()
+    await response.prepare(request)
+
+    encoder = _Encoder(encoding)
+    kept: Optional[bytearray] = bytearray() if keep > 0 else None
+
+    async def write(data: bytes) -> None:
+        nonlocal kept
+        if not data:
+            return
+        await response.write(data)
+        if kept is not None:
+            kept += data
+            if len(kept) > keep:
+                kept = None
+
+    async for chunk in body.chunks:
+        await write(encoder.encode(chunk))
+    await write(encoder.finish())
+    await response.write_eof()
+
+    return response, None if kept is None else bytes(kept)
+
+
+async def cached_response(
+    request: Request,
+    version: str,
+    build: Callable[[], Awaitable[ResponseBody]],
+    variant: str = "",
+) -> StreamResponse:
+    """
+    Answers `request` with the body that `build` returns for the given
+    `version` of the data.
+
+    The `variant` distinguishes different representations of the same
+    data, e.g. JSON and NDJSON. The query parameters always do.
+    """
+    cache: ResponseCache = request.app["response_cache"]
+
+    etag = make_etag(version, variant)
+    headers = {"ETag": etag, "Vary": "Accept, Accept-Encoding"}
+    if _etag_matches(request, etag):
+        cache.not_modified += 1
+        return Response(status=304, headers=headers)
+
+    key = _cache_key(request, variant)
+    encoding = choose_encoding(request)
+    if entry := cache.get(key, etag, encoding):
+        cache.hits += 1
+        response = Response(
+            body=entry.bodies[encoding], headers={**entry.headers, **headers}
+        )
+        response.content_type = entry.content_type
+        if encoding != IDENTITY:
+            response.headers["Content-Encoding"] = encoding
+        return response
+
+    cache.misses += 1
+    body = await build()
+    response, encoded = await send_body(
+        request, body, encoding, headers, keep=cache.max_body_bytes
+    )
+    if encoded is not None:
+        cache.put(key, etag, encoding, encoded, body.content_type, body.headers)
+
+    return response
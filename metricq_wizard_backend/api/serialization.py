@@ -0,0 +1,121 @@
+# metricq-wizard
+# Copyright (C) 2026 ZIH, CIDS, Technische Universitaet Dresden,
+#                    Federal Republic of Germany
+#
+# All rights reserved.
+#
+# This file is part of metricq-wizard.
+#
+# metricq-wizard is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# metricq-wizard is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with metricq-wizard.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+JSON encoding of the API responses.
+
+All views encode with :func:`dumps`, which writes bytes directly. If orjson
+is installed, it is used, otherwise we fall back to the json module.
+"""
+
+import json
+from typing import Any, Callable, Optional
+
+import metricq
+from aiohttp.web_response import Response
+from pydantic import BaseModel
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+CONTENT_TYPE = "application/json"
+
+
+def _default(obj: Any) -> Any:
+    """Encodes the types, that neither encoder knows by itself"""
+    if isinstance(obj, metricq.Timedelta):
+        # the same format as the json_encoders of our models
+        return f"{obj.ms:.0f}ms"
+    if isinstance(obj, metricq.Timestamp):
+        return obj.datetime.isoformat()
+    if isinstance(obj, BaseModel):
+        return obj.dict()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def _dumps_json(data: Any) -> bytes:
+    return json.dumps(
+        data, default=_default, ensure_ascii=False, separators=(",", ":")
+    ).encode()
+
+
+def _dumps_orjson(data: Any) -> bytes:
+    try:
+        return orjson.dumps(data, default=_default)
+    except orjson.JSONEncodeError:
+        # orjson refuses some things, that the json module encodes, e.g. keys
+        # that aren't strings or integers beyond 64 bit
+        return _dumps_json(data)
+
+
+ENCODERS: dict[str, Callable[[Any], bytes]] = {"json": _dumps_json}
+if orjson is not None:
+    ENCODERS["orjson"] = _dumps_orjson
+
+_dumps: Callable[[Any], bytes] = ENCODERS.get("orjson", _dumps_json)
+
+
+def set_encoder(name: str) -> None:
+    """
+    Selects the encoder by name, "auto" picks the fastest one available.
+    """
+    global _dumps
+    if name == "auto":
+        name = "orjson" if "orjson" in ENCODERS else "json"
+    if name not in ENCODERS:
+        raise ValueError(f"JSON encoder {name} is not available")
+    _dumps = ENCODERS[name]
+
+
+def dumps(data: Any) -> bytes:
+    return _dumps(data)
+
+
+def dumps_model(model: BaseModel, by_alias: bool = False) -> bytes:
+    return _dumps(model.dict(by_alias=by_alias))
+
+
+def json_response(
+    data: Any,
+    *,
+    status: int = 200,
+    reason: Optional[str] = None,
+    headers: Optional[dict[str, str]] = None,
+) -> Response:
+    return Response(
+        body=dumps(data),
+        status=status,
+        reason=reason,
+        headers=headers,
+        content_type=CONTENT_TYPE,
+    )
+
+
+def model_response(
+    model: BaseModel, by_alias: bool = False, status: int = 200
+) -> Response:
+    return Response(
+        body=dumps_model(model, by_alias=by_alias),
+        status=status,
+        content_type=CONTENT_TYPE,
+    )
@@ -5,6 +5,7 @@ from .source import routes as source_routes
 from .topology import routes as topology_routes
 from .transformer import routes as transformer_routes
 from .cluster import routes as cluster_routes
+from .stats import routes as stats_routes
 
 
 def add_routes_to_app(app):
@@ -15,3 +16,4 @@ def add_routes_to_app(app):
     app.router.add_routes(transformer_routes)
     app.router.add_routes(topology_routes)
     app.router.add_routes(cluster_routes)
+    app.router.add_routes(stats_routes)
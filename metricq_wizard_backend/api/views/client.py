@@ -20,10 +20,11 @@
 
 import metricq
 from aiohttp.web_request import Request
-from aiohttp.web_response import json_response
 from aiohttp.web_routedef import RouteTableDef
 from aiohttp_swagger import swagger_path
 
+from metricq_wizard_backend.api.response_cache import ResponseBody, cached_response
+from metricq_wizard_backend.api.serialization import dumps, json_response
 from metricq_wizard_backend.metricq import Configurator
 
 logger = metricq.get_logger()
@@ -50,7 +51,13 @@ async def get_client_list(request: Request):
 async def get_active_clients(request: Request):
     configurator: Configurator = request.app["metricq_client"]
 
-    return json_response(data=await configurator.fetch_active_clients())
+    async def build() -> ResponseBody:
+        clients = await configurator.fetch_active_clients()
+        return ResponseBody.from_bytes(dumps(clients))
+
+    return await cached_response(
+        request, await configurator.data_version("clients"), build
+    )
 
 
 @swagger_path("api_doc/get_clients_dependency.yaml")
@@ -58,7 +65,18 @@ async def get_active_clients(request: Request):
 async def get_clients_dependencies(request: Request):
     configurator: Configurator = request.app["metricq_client"]
 
-    return json_response(data=await configurator.fetch_dependency_wheel())
+    wheel = await configurator.dependency_wheel()
+    if wheel is None:
+        version = await configurator.data_version("config", "metadata", "bindings")
+    else:
+        # only changes, when the counts do
+        version = wheel.etag
+
+    async def build() -> ResponseBody:
+        result = await configurator.fetch_dependency_wheel()
+        return ResponseBody.from_bytes(dumps(result))
+
+    return await cached_response(request, version, build)
 
 
 @swagger_path("api_doc/create_client.yaml")
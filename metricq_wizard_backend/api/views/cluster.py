@@ -23,9 +23,9 @@ import asyncio
 
 from aiocouch import NotFoundError
 from aiohttp.web_request import Request
-from aiohttp.web_response import json_response
 from aiohttp.web_routedef import RouteTableDef
 
+from metricq_wizard_backend.api.serialization import json_response
 from metricq_wizard_backend.metricq import ClusterScanner
 
 routes = RouteTableDef()
@@ -85,4 +85,18 @@ async def get_health_scan(request: Request):
     if scanner.running:
         status = "running"
 
-    return json_response(data={"status": status})
+    return json_response(
+        data={
+            "status": status,
+            "incremental": scanner.incremental_running,
+            "scheduled": scanner.scheduled_checks,
+            "lag": scanner.schedule_lag,
+        }
+    )
+
+
+@routes.get("/api/cluster/health_scan/stats")
+async def get_health_scan_stats(request: Request):
+    scanner: ClusterScanner = request.app["cluster_scanner"]
+
+    return json_response(data=scanner.stats())
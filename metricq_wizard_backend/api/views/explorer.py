@@ -21,11 +21,10 @@
 import metricq
 
 from aiohttp.web_request import Request
-from aiohttp.web import json_response
 from aiohttp.web_routedef import RouteTableDef
 
+from metricq_wizard_backend.api.serialization import json_response
 from metricq_wizard_backend.metricq import Configurator
-from metricq_wizard_backend.metricq.network import Network
 
 logger = metricq.get_logger()
 
@@ -37,6 +36,16 @@ async def get_metric_metadata(request: Request):
     configurator: Configurator = request.app["metricq_client"]
     metric = request.match_info["metric"]
 
-    network = Network(metric, configurator)
-
-    return json_response(await network.search())
+    try:
+        depth = int(request.query["depth"]) if "depth" in request.query else None
+    except ValueError:
+        return json_response(
+            {"status": "error", "message": "depth must be an integer"}, status=400
+        )
+
+    try:
+        return json_response(await configurator.lineage.search(metric, depth))
+    except KeyError:
+        return json_response(
+            {"status": "error", "message": f"Metric {metric} not found"}, status=404
+        )
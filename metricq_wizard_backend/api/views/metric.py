@@ -18,82 +18,254 @@
 # You should have received a copy of the GNU General Public License
 # along with metricq-wizard.  If not, see <http://www.gnu.org/licenses/>.
 import asyncio
+import base64
 import json
 import math
-from typing import Any
+from typing import Any, AsyncIterator, Awaitable, Callable, Optional
 
 import metricq
 from aiohttp.web_request import Request
-from aiohttp.web_response import Response, json_response
+from aiohttp.web_response import StreamResponse
 from aiohttp.web_routedef import RouteTableDef
 
 from metricq_wizard_backend.api.models import MetricDatabaseConfigurations
+from metricq_wizard_backend.api.response_cache import (
+    ResponseBody,
+    cached_response,
+    send_body,
+)
+from metricq_wizard_backend.api.serialization import dumps, json_response
 from metricq_wizard_backend.metricq import ClusterScanner, Configurator
+from metricq_wizard_backend.metricq.couchdb import MutationStatus, chunked
 
 logger = metricq.get_logger()
 logger.setLevel("DEBUG")
 
 routes = RouteTableDef()
 
+JsonDict = dict[str, Any]
+
+
+NDJSON = "application/x-ndjson"
+
+# the size of the chunks written to streamed responses
+STREAM_CHUNK_SIZE = 64 * 1024
+# the number of metrics encoded with a single call of the encoder
+ENCODE_BATCH_SIZE = 256
+
+
+def _accepts_ndjson(request: Request) -> bool:
+    return NDJSON in request.headers.get("Accept", "")
+
+
+async def _encode_metrics(
+    metrics: AsyncIterator[tuple[str, Optional[JsonDict]]], ndjson: bool
+) -> AsyncIterator[bytes]:
+    """
+    Encodes the metrics as they are read, as NDJSON or as a JSON array. Each
+    metric gets its id set.
+    """
+    buffer = bytearray() if ndjson else bytearray(b"[")
+    batch: list[JsonDict] = []
+    first = True
+
+    def encode_batch() -> None:
+        nonlocal first
+        if not batch:
+            return
+        if ndjson:
+            for metric in batch:
+                buffer.extend(dumps(metric))
+                buffer.extend(b"\n")
+        else:
+            if not first:
+                buffer.extend(b",")
+            # encode the batch as one array and strip the brackets
+            buffer.extend(memoryview(dumps(batch))[1:-1])
+        first = False
+        batch.clear()
+
+    async for metric_id, metric in metrics:
+        if metric is None:
+            metric = {}
+        metric["id"] = metric_id
+        batch.append(metric)
+
+        if len(batch) >= ENCODE_BATCH_SIZE:
+            encode_batch()
+            if len(buffer) >= STREAM_CHUNK_SIZE:
+                yield bytes(buffer)
+                buffer.clear()
+
+    encode_batch()
+    if not ndjson:
+        buffer += b"]"
+    yield bytes(buffer)
+
+
+async def _fetch_requested_metrics(
+    client: Configurator, metric_ids: list[str], chunk_size: int = 1000
+) -> AsyncIterator[tuple[str, Optional[JsonDict]]]:
+    """The metadata of the metrics in the requested order, None if missing"""
+    for chunk in chunked(metric_ids, chunk_size):
+        metadata = await client.fetch_metadata(list(dict.fromkeys(chunk)))
+        for metric_id in chunk:
+            yield metric_id, metadata.get(metric_id)
+
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def _encode_cursor(after: str) -> str:
+    return base64.urlsafe_b64encode(json.dumps({"after": after}).encode()).decode()
+
+
+def _decode_cursor(cursor: str) -> str:
+    try:
+        after = json.loads(base64.urlsafe_b64decode(cursor.encode()))["after"]
+    except (ValueError, TypeError, KeyError):
+        raise ValueError("invalid cursor")
+    if not isinstance(after, str):
+        raise ValueError("invalid cursor")
+    return after
+
+
+def _parse_pagination(params: Any) -> tuple[Optional[int], Optional[str], bool]:
+    """
+    Reads page_size, cursor and sort ("id" or "-id") from the query or the
+    request body. Returns the page size, the id to continue after and
+    whether to sort descending.
+    """
+    page_size = params.get("page_size", None)
+    if page_size is not None:
+        page_size = int(page_size)
+        if page_size <= 0:
+            raise ValueError("page_size must be positive")
+
+    cursor = params.get("cursor", None)
+    after = _decode_cursor(cursor) if cursor is not None else None
+
+    sort = params.get("sort", "id")
+    if sort not in ("id", "-id"):
+        raise ValueError(f"cannot sort by {sort}")
+
+    return page_size, after, sort == "-id"
+
+
+async def _metrics_body(
+    metrics: AsyncIterator[tuple[str, Optional[JsonDict]]],
+    page_size: Optional[int],
+    ndjson: bool,
+) -> ResponseBody:
+    """
+    The body with all `metrics`, or a page of them, if `page_size` is given.
+    In that case, `metrics` must yield one more than `page_size` if there is
+    a next page, and the cursor to it is sent in the X-Next-Cursor header.
+    """
+    content_type = NDJSON if ndjson else "application/json"
+    if page_size is None:
+        return ResponseBody(_encode_metrics(metrics, ndjson), content_type)
+
+    page = []
+    async for metric in metrics:
+        page.append(metric)
+        if len(page) > page_size:
+            break
+
+    headers = {}
+    if len(page) > page_size:
+        page = page[:page_size]
+        headers[NEXT_CURSOR_HEADER] = _encode_cursor(page[-1][0])
+
+    async def send_page() -> AsyncIterator[tuple[str, Optional[JsonDict]]]:
+        for metric in page:
+            yield metric
+
+    return ResponseBody(_encode_metrics(send_page(), ndjson), content_type, headers)
+
+
+async def _respond_metrics(
+    request: Request,
+    metrics: AsyncIterator[tuple[str, Optional[JsonDict]]],
+    page_size: Optional[int],
+) -> StreamResponse:
+    body = await _metrics_body(metrics, page_size, _accepts_ndjson(request))
+    response, _ = await send_body(request, body)
+    return response
+
 
 @routes.get("/api/metrics")
 async def get_metric_list(request: Request):
     client: Configurator = request.app["metricq_client"]
     infix = request.query.get("infix", None)
+    prefix = request.query.get("prefix", None)
+    source = request.query.get("source", None)
     limit = request.query.get("limit", None)
-    historic = request.query.get("historic", False)
+    historic = request.query.get("historic", None)
     if limit:
         limit = int(limit)
-    metric_dict = await client.get_metrics(
-        infix=infix, format="object", historic=historic, limit=limit
+    if historic is not None:
+        historic = historic.lower() in ("1", "true", "yes")
+    try:
+        page_size, after, descending = _parse_pagination(request.query)
+        metrics = client.iter_metrics(
+            infix=infix,
+            prefix=prefix,
+            source=source,
+            historic=historic,
+            limit=limit if page_size is None else page_size + 1,
+            after=after,
+            descending=descending,
+        )
+    except (AttributeError, ValueError) as e:
+        return json_response({"status": "error", "message": str(e)}, status=400)
+
+    # Nothing is read from `metrics` yet, so if the client already has this
+    # version, or it is cached, we never touch it.
+    ndjson = _accepts_ndjson(request)
+    return await cached_response(
+        request,
+        await client.data_version("metadata"),
+        lambda: _metrics_body(metrics, page_size, ndjson),
+        variant=NDJSON if ndjson else "json",
     )
-    metric_list = []
-    for metric_id in metric_dict:
-        metric = metric_dict[metric_id]
-        metric["id"] = metric_id
-        metric_list.append(metric)
-
-    return Response(text=json.dumps(metric_list), content_type="application/json")
 
 
 @routes.post("/api/metrics")
 async def post_metric_list(request: Request):
     client: Configurator = request.app["metricq_client"]
     request_data = await request.json()
+    try:
+        page_size, after, descending = _parse_pagination(request_data)
+    except ValueError as e:
+        return json_response({"status": "error", "message": str(e)}, status=400)
+
+    limit = None if page_size is None else page_size + 1
     if "requested_metrics" in request_data:
+        # The client knows the list of metrics, so there is nothing to page
+        # through. It keeps the requested order.
         requested_metrics = request_data.get("requested_metrics", [])
-
-        metric_dict = await client.get_metrics(
-            format="object", selector=requested_metrics
-        )
-        metric_list = []
-        for metric_id in requested_metrics:
-            if metric_id in metric_dict:
-                metric = metric_dict[metric_id]
-                metric["id"] = metric_id
-                metric_list.append(metric)
-            else:
-                metric = {"id": metric_id}
-                metric_list.append(metric)
+        metrics = _fetch_requested_metrics(client, requested_metrics)
+        page_size = None
     elif "database" in request_data:
         requested_database = request_data["database"]
 
         # TODO filter db
 
-        metric_dict = await client.get_metrics(historic=True, format="object")
-        metric_list = []
-        for metric_id, metric in metric_dict.items():
-            metric["id"] = metric_id
-            metric_list.append(metric)
+        metrics = client.iter_metrics(
+            historic=True, limit=limit, after=after, descending=descending
+        )
     elif "source" in request_data:
         requested_source = request_data["source"]
-        metric_dict = await client.get_metrics(source=requested_source, format="object")
-        metric_list = []
-        for metric_id, metric in metric_dict.items():
-            metric["id"] = metric_id
-            metric_list.append(metric)
+        metrics = client.iter_metrics(
+            source=requested_source, limit=limit, after=after, descending=descending
+        )
+    else:
+        return json_response(
+            {"status": "error", "message": "Invalid request data"}, status=400
+        )
 
-    return Response(text=json.dumps(metric_list), content_type="application/json")
+    return await _respond_metrics(request, metrics, page_size)
 
 
 def _get_interval_max_ms(interval_min_ms: int, interval_factor: int) -> int:
@@ -106,6 +278,43 @@ def _get_interval_max_ms(interval_min_ms: int, interval_factor: int) -> int:
     return interval_min_ms * (interval_factor ** (n + 1))
 
 
+async def _stream_statuses(
+    request: Request,
+    statuses: AsyncIterator[tuple[str, str]],
+    on_success: Optional[Callable[[list[str]], Awaitable[Any]]] = None,
+) -> StreamResponse:
+    """
+    Sends the status of each metric of a bulk operation as an NDJSON line,
+    as soon as it is known, and a final line with the overall status.
+    `on_success` is called with the successful metrics before that line.
+    """
+    response = StreamResponse()
+    response.content_type = NDJSON
+    response.enable_chunked_encoding()
+    await response.prepare(request)
+
+    succeeded = []
+    failed = 0
+    async for metric, status in statuses:
+        if status == MutationStatus.OK:
+            succeeded.append(metric)
+        else:
+            failed += 1
+        await response.write(dumps({"metric": metric, "status": status}) + b"\n")
+
+    if on_success is not None:
+        await on_success(succeeded)
+
+    summary = {
+        "status": "partial" if failed else "ok",
+        "succeeded": len(succeeded),
+        "failed": failed,
+    }
+    await response.write(dumps(summary) + b"\n")
+    await response.write_eof()
+    return response
+
+
 @routes.post("/api/metrics/delete_metadata")
 async def post_metrics_delete_metadata(request: Request):
     client: Configurator = request.app["metricq_client"]
@@ -127,16 +336,24 @@ async def post_metrics_delete_metadata(request: Request):
             {"status": "error", "message": "Invalid metric list in request"}, status=400
         )
 
-    deleted_metrics = await client.delete_metadata(metrics)
-
     scanner: ClusterScanner = request.app["cluster_scanner"]
-    await asyncio.gather(
-        *[
-            scanner.delete_issue_reports(scope_type="metric", scope=metric)
-            for metric in deleted_metrics
-        ],
-        return_exceptions=True,
-    )
+
+    async def delete_issue_reports(deleted_metrics: list[str]) -> None:
+        await asyncio.gather(
+            *[
+                scanner.delete_issue_reports(scope_type="metric", scope=metric)
+                for metric in deleted_metrics
+            ],
+            return_exceptions=True,
+        )
+
+    if _accepts_ndjson(request):
+        return await _stream_statuses(
+            request, client.stream_delete_metadata(metrics), delete_issue_reports
+        )
+
+    deleted_metrics = await client.delete_metadata(metrics)
+    await delete_issue_reports(deleted_metrics)
 
     if set(deleted_metrics) == set(metrics):
         return json_response(
@@ -157,6 +374,30 @@ async def post_metrics_delete_metadata(request: Request):
         )
 
 
+@routes.post("/api/metrics/impact")
+async def post_metrics_impact(request: Request):
+    client: Configurator = request.app["metricq_client"]
+    data: dict[str, Any] = await request.json()
+
+    if (
+        not isinstance(data, dict)
+        or "metrics" not in data
+        or not isinstance(data["metrics"], list)
+    ):
+        return json_response(
+            {"status": "error", "message": "Invalid request data"}, status=400
+        )
+
+    metrics: list[metricq.Metric] = data["metrics"]
+
+    if any([not isinstance(id, str) for id in metrics]) or len(metrics) == 0:
+        return json_response(
+            {"status": "error", "message": "Invalid metric list in request"}, status=400
+        )
+
+    return json_response(await client.metrics_impact(metrics))
+
+
 @routes.post("/api/metrics/archive")
 async def post_metrics_archive(request: Request):
     client: Configurator = request.app["metricq_client"]
@@ -178,6 +419,9 @@ async def post_metrics_archive(request: Request):
             {"status": "error", "message": "Invalid metric list in request"}, status=400
         )
 
+    if _accepts_ndjson(request):
+        return await _stream_statuses(request, client.stream_archive_metrics(metrics))
+
     archived_metrics = await client.archive_metrics(metrics)
 
     if set(archived_metrics) == set(metrics):
@@ -220,6 +464,9 @@ async def post_metrics_hide(request: Request):
             {"status": "error", "message": "Invalid metric list in request"}, status=400
         )
 
+    if _accepts_ndjson(request):
+        return await _stream_statuses(request, client.stream_hide_metrics(metrics))
+
     hid_metrics = await client.hide_metrics(metrics)
 
     if set(hid_metrics) == set(metrics):
@@ -270,6 +517,11 @@ async def post_metrics_historic(request: Request):
             {"status": "error", "message": "Invalid metric dict in request"}, status=400
         )
 
+    if _accepts_ndjson(request):
+        return await _stream_statuses(
+            request, client.stream_metrics_update_historic(metrics)
+        )
+
     updated_metrics = await client.metrics_update_historic(metrics)
 
     if set(updated_metrics) == set(metrics):
@@ -321,7 +573,7 @@ async def post_metric_database_default_config(request: Request):
                         f"Metric {metric_id} has invalid rate: {metric_config['rate']}"
                     )
 
-    return Response(text=json.dumps(metric_list), content_type="application/json")
+    return json_response(metric_list)
 
 
 @routes.post("/api/metrics/database")
@@ -330,70 +582,58 @@ async def post_metric_database(request: Request):
     request_data = await request.json()
 
     database_configs = MetricDatabaseConfigurations(**request_data)
-    await client.update_metric_database_config(database_configs.database_configurations)
-
-    return Response(
-        text=database_configs.json(by_alias=True),
-        content_type="application/json",
+    results = await client.update_metric_database_config(
+        database_configs.database_configurations
     )
 
+    response = database_configs.dict(by_alias=True)
+    response["results"] = results
+
+    return json_response(response)
+
 
 @routes.get("/api/databases")
 async def get_db_list(request: Request):
     configurator: Configurator = request.app["metricq_client"]
-    config_dict = await configurator.get_configs()
-    db_list = []
-    for config_id in config_dict.keys():
-        if config_id.startswith("db-"):
-            try:
-                db_list.append({"id": config_id})
-            except KeyError:
-                logger.error(
-                    f"Config of database {config_id} is incorrect! Missing key"
-                )
-            except AttributeError:
-                logger.error(
-                    f"Config of database {config_id} is incorrect! 'metrics' is list not dict"
-                )
-
-    return Response(text=json.dumps(db_list), content_type="application/json")
+
+    async def build() -> ResponseBody:
+        tokens = await configurator.list_tokens(role="db")
+        return ResponseBody.from_bytes(dumps([{"id": token} for token in tokens]))
+
+    return await cached_response(
+        request, await configurator.data_version("config"), build
+    )
 
 
 @routes.post("/api/databases/historic_metrics")
 async def post_db_list_with_historic_metrics(request: Request):
     configurator: Configurator = request.app["metricq_client"]
-    config_dict = await configurator.get_configs()
     data = await request.json()
+    configurations = await configurator.fetch_database_configurations(
+        data["selectedMetrics"]
+    )
     db_list = []
-    for config_id, config in config_dict.items():
-        if config_id.startswith("db-"):
-            try:
-                db_list.append(
-                    {
-                        "id": config_id,
-                        "metrics": [
-                            {
-                                "id": metric_id,
-                                "databaseId": config_id,
-                                "intervalMin": f"{metric_config['interval_min'] / 1e6:.0f}ms",
-                                "intervalMax": f"{metric_config['interval_max'] / 1e6:.0f}ms",
-                                "intervalFactor": metric_config["interval_factor"],
-                            }
-                            for metric_id, metric_config in config["metrics"].items()
-                            if metric_id in data["selectedMetrics"]
-                        ],
-                    }
-                )
-            except KeyError:
-                logger.error(
-                    f"Config of database {config_id} is incorrect! Missing key"
-                )
-            except AttributeError:
-                logger.error(
-                    f"Config of database {config_id} is incorrect! 'metrics' is list not dict"
-                )
-
-    return Response(text=json.dumps(db_list), content_type="application/json")
+    for config_id, metric_configs in configurations.items():
+        try:
+            db_list.append(
+                {
+                    "id": config_id,
+                    "metrics": [
+                        {
+                            "id": metric_id,
+                            "databaseId": config_id,
+                            "intervalMin": f"{metric_config['interval_min'] / 1e6:.0f}ms",
+                            "intervalMax": f"{metric_config['interval_max'] / 1e6:.0f}ms",
+                            "intervalFactor": metric_config["interval_factor"],
+                        }
+                        for metric_id, metric_config in metric_configs.items()
+                    ],
+                }
+            )
+        except KeyError:
+            logger.error(f"Config of database {config_id} is incorrect! Missing key")
+
+    return json_response(db_list)
 
 
 @routes.post("/api/database/{database_id}/reconfigure")
@@ -403,9 +643,7 @@ async def reconfigure_database(request: Request):
     if not request.app["settings"].dry_run:
         await configurator.reconfigure_client(token=database_id)
 
-    return Response(
-        text=json.dumps({"status": "success"}), content_type="application/json"
-    )
+    return json_response({"status": "success"})
 
 
 @routes.get("/api/metric/{metric_id}/consumers")
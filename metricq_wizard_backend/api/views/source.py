@@ -17,16 +17,15 @@
 #
 # You should have received a copy of the GNU General Public License
 # along with metricq-wizard.  If not, see <http://www.gnu.org/licenses/>.
-import json
-
 import metricq
 from aiohttp.web_exceptions import HTTPBadRequest
 from aiohttp.web_request import Request
-from aiohttp.web_response import Response
 from aiohttp.web_routedef import RouteTableDef
 from aiohttp_swagger import swagger_path
 
+from metricq_wizard_backend.api.serialization import json_response, model_response
 from metricq_wizard_backend.metricq import Configurator
+from metricq_wizard_backend.metricq.configurator import CLIENT_ROLE_PREFIXES
 from metricq_wizard_backend.metricq.source_plugin import AddMetricItem
 
 logger = metricq.get_logger()
@@ -39,7 +38,7 @@ routes = RouteTableDef()
 @routes.get("/api/sources")
 async def get_source_list(request: Request):
     configurator: Configurator = request.app["metricq_client"]
-    configs = await configurator.get_configs("^source-.*")
+    configs = await configurator.read_configs(CLIENT_ROLE_PREFIXES["source"])
     source_list = []
     for token, config in configs.items():
         source_list.append(
@@ -50,7 +49,7 @@ async def get_source_list(request: Request):
             }
         )
 
-    return Response(text=json.dumps(source_list), content_type="application/json")
+    return json_response(source_list)
 
 
 @swagger_path("api_doc/get_source_config_items.yaml")
@@ -66,17 +65,14 @@ async def get_source_config_items(request: Request):
         source_id=source_id, session_key=session_key
     )
 
-    return Response(
-        text=json.dumps(
-            {
-                "configItemName": source_plugin.get_config_item_name(),
-                "configItems": [
-                    config_item.dict()
-                    for config_item in await source_plugin.get_configuration_items()
-                ],
-            }
-        ),
-        content_type="application/json",
+    return json_response(
+        {
+            "configItemName": source_plugin.get_config_item_name(),
+            "configItems": [
+                config_item.dict()
+                for config_item in await source_plugin.get_configuration_items()
+            ],
+        }
     )
 
 
@@ -97,7 +93,7 @@ async def add_source_config_item(request: Request):
 
     config_item = await source_plugin.add_config_item(request_data)
 
-    return Response(text=config_item.json(), content_type="application/json")
+    return model_response(config_item)
 
 
 @swagger_path("api_doc/get_source_metrics_for_config_item.yaml")
@@ -116,9 +112,7 @@ async def get_source_metrics_for_config_item(request: Request):
 
     metric_list = await source_plugin.get_metrics_for_config_item(config_item_id)
 
-    return Response(
-        text=metric_list.json(by_alias=True), content_type="application/json"
-    )
+    return model_response(metric_list, by_alias=True)
 
 
 @swagger_path("api_doc/add_source_metrics_for_config_item.yaml")
@@ -147,9 +141,7 @@ async def add_source_metrics_for_config_item(request: Request):
         not_selected_metric_ids,
     )
 
-    return Response(
-        text=json.dumps({"metrics": new_metrics}), content_type="application/json"
-    )
+    return json_response({"metrics": new_metrics})
 
 
 @routes.get("/api/source/{source_id}/config_items/input_form")
@@ -164,10 +156,7 @@ async def get_source_add_config_item_input_form(request: Request):
         source_id=source_id, session_key=session_key
     )
 
-    return Response(
-        text=json.dumps(source_plugin.input_form_add_config_item()),
-        content_type="application/json",
-    )
+    return json_response(source_plugin.input_form_add_config_item())
 
 
 @routes.get("/api/source/{source_id}/config_item/{config_item_id}/input_form")
@@ -182,10 +171,7 @@ async def get_source_edit_config_item_input_form(request: Request):
         source_id=source_id, session_key=session_key
     )
 
-    return Response(
-        text=json.dumps(source_plugin.input_form_edit_config_item()),
-        content_type="application/json",
-    )
+    return json_response(source_plugin.input_form_edit_config_item())
 
 
 @swagger_path("api_doc/get_source_config_item.yaml")
@@ -204,9 +190,7 @@ async def get_source_config_item(request: Request):
 
     config_item_config = await source_plugin.get_config_item(config_item_id)
 
-    return Response(
-        text=json.dumps(config_item_config), content_type="application/json"
-    )
+    return json_response(config_item_config)
 
 
 @swagger_path("api_doc/update_source_config_item.yaml")
@@ -227,7 +211,7 @@ async def update_source_config_item(request: Request):
 
     config_item = await source_plugin.update_config_item(config_item_id, request_data)
 
-    return Response(text=config_item.json(), content_type="application/json")
+    return model_response(config_item)
 
 
 @swagger_path("api_doc/delete_source_config_item.yaml")
@@ -246,9 +230,7 @@ async def delete_source_config_item(request: Request):
 
     await source_plugin.delete_config_item(config_item_id)
 
-    return Response(
-        text=json.dumps({"status": "success"}), content_type="application/json"
-    )
+    return json_response({"status": "success"})
 
 
 @routes.get("/api/source/{source_id}/input_form")
@@ -263,10 +245,7 @@ async def get_source_edit_global_config_input_form(request: Request):
         source_id=source_id, session_key=session_key
     )
 
-    return Response(
-        text=json.dumps(await source_plugin.input_form_edit_global_config()),
-        content_type="application/json",
-    )
+    return json_response(await source_plugin.input_form_edit_global_config())
 
 
 @swagger_path("api_doc/get_source_config.yaml")
@@ -284,9 +263,7 @@ async def get_source_global_config(request: Request):
 
     source_global_config = await source_plugin.get_global_config()
 
-    return Response(
-        text=json.dumps(source_global_config), content_type="application/json"
-    )
+    return json_response(source_global_config)
 
 
 @swagger_path("api_doc/update_source_config.yaml")
@@ -306,9 +283,7 @@ async def update_source_global_config(request: Request):
 
     source_global_config = await source_plugin.update_global_config(request_data)
 
-    return Response(
-        text=json.dumps(source_global_config), content_type="application/json"
-    )
+    return json_response(source_global_config)
 
 
 @swagger_path("api_doc/save_source_config.yaml")
@@ -324,10 +299,7 @@ async def save_source_config(request: Request):
         source_id=source_id, session_key=session_key, unload_plugin=True
     )
 
-    return Response(
-        text=json.dumps({"status": "success", "metrics": metrics}),
-        content_type="application/json",
-    )
+    return json_response({"status": "success", "metrics": metrics})
 
 
 @swagger_path("api_doc/reconfigure_source.yaml")
@@ -338,9 +310,7 @@ async def reconfigure_source(request: Request):
     if not request.app["settings"].dry_run:
         await configurator.reconfigure_client(token=source_id)
 
-    return Response(
-        text=json.dumps({"status": "success"}), content_type="application/json"
-    )
+    return json_response({"status": "success"})
 
 
 @swagger_path("api_doc/save_config_and_reconfigure_source.yaml")
@@ -358,10 +328,7 @@ async def save_config_and_reconfigure_source(request: Request):
     if not request.app["settings"].dry_run:
         await configurator.reconfigure_client(token=source_id)
 
-    return Response(
-        text=json.dumps({"status": "success", "metrics": metrics}),
-        content_type="application/json",
-    )
+    return json_response({"status": "success", "metrics": metrics})
 
 
 @swagger_path("api_doc/get_source_raw_config.yaml")
@@ -378,9 +345,7 @@ async def get_source_raw_config(request: Request):
     for key in keys_to_filter:
         del config[key]
 
-    return Response(
-        text=json.dumps({"config": config}), content_type="application/json"
-    )
+    return json_response({"config": config})
 
 
 @swagger_path("api_doc/save_source_raw_config.yaml")
@@ -400,9 +365,7 @@ async def save_source_raw_config(request: Request):
 
     await configurator.set_config(source_id, request_data)
 
-    return Response(
-        text=json.dumps({"status": "success"}), content_type="application/json"
-    )
+    return json_response({"status": "success"})
 
 
 # @swagger_path("api_doc/save_source_raw_config.yaml")
@@ -424,7 +387,7 @@ async def get_session_state(request: Request):
     if plugin_creation_time is not None:
         response["plugin_creation_time"] = plugin_creation_time.datetime.isoformat()
 
-    return Response(text=json.dumps(response), content_type="application/json")
+    return json_response(response)
 
 
 # @swagger_path("api_doc/save_source_raw_config.yaml")
@@ -441,6 +404,4 @@ async def post_reset_session(request: Request):
 
     session.unload_source_plugin(source_id)
 
-    return Response(
-        text=json.dumps({"status": "success"}), content_type="application/json"
-    )
+    return json_response({"status": "success"})
@@ -0,0 +1,40 @@
+# metricq-wizard
+# Copyright (C) 2026 ZIH, CIDS, Technische Universitaet Dresden,
+#                    Federal Republic of Germany
+#
+# All rights reserved.
+#
+# This file is part of metricq-wizard.
+#
+# metricq-wizard is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# metricq-wizard is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with metricq-wizard.  If not, see <http://www.gnu.org/licenses/>.
+
+from aiohttp.web_request import Request
+from aiohttp.web_routedef import RouteTableDef
+
+from metricq_wizard_backend.api.response_cache import ResponseCache
+from metricq_wizard_backend.api.serialization import json_response
+from metricq_wizard_backend.metricq import Configurator
+
+routes = RouteTableDef()
+
+
+@routes.get("/api/stats")
+async def get_stats(request: Request):
+    """The sizes and limits of the in-memory registries and caches"""
+    configurator: Configurator = request.app["metricq_client"]
+    response_cache: ResponseCache = request.app["response_cache"]
+
+    return json_response(
+        {**configurator.stats(), "response_cache": response_cache.stats()}
+    )
@@ -20,10 +20,10 @@
 import json
 
 from aiohttp.web_request import Request
-from aiohttp.web_response import json_response
 from aiohttp.web_routedef import RouteTableDef
 from aiohttp_swagger import swagger_path
 
+from metricq_wizard_backend.api.serialization import json_response
 from metricq_wizard_backend.metricq import Configurator
 
 routes = RouteTableDef()
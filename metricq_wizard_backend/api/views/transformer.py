@@ -17,8 +17,6 @@
 #
 # You should have received a copy of the GNU General Public License
 # along with metricq-wizard.  If not, see <http://www.gnu.org/licenses/>.
-import json
-
 import metricq
 from aiohttp import web_exceptions
 from aiohttp.web_request import Request
@@ -26,6 +24,7 @@ from aiohttp.web_response import Response
 from aiohttp.web_routedef import RouteTableDef
 from aiohttp_swagger import swagger_path
 
+from metricq_wizard_backend.api.serialization import json_response
 from metricq_wizard_backend.metricq import Configurator
 
 logger = metricq.get_logger()
@@ -37,18 +36,17 @@ routes = RouteTableDef()
 @routes.get("/api/transformers")
 async def get_transformer_list(request: Request):
     configurator: Configurator = request.app["metricq_client"]
-    tokens = await configurator.get_client_tokens()
+    tokens = await configurator.list_tokens(role="transformer")
     transformers = []
     for token in tokens:
-        if token.startswith("transformer-"):
-            transformers.append(
-                {
-                    "id": token,
-                    "isCombinator": "combinator" in token.lower(),
-                }
-            )
+        transformers.append(
+            {
+                "id": token,
+                "isCombinator": "combinator" in token.lower(),
+            }
+        )
 
-    return Response(text=json.dumps(transformers), content_type="application/json")
+    return json_response(transformers)
 
 
 @swagger_path("api_doc/transformer/get_combinator_metric_expression.yaml")
@@ -63,16 +61,13 @@ async def get_combinator_metric_expression(request: Request):
     if expression is None:
         raise web_exceptions.HTTPNotFound
 
-    return Response(
-        text=json.dumps(
-            {
-                "transformerId": transformer_id,
-                "metric": metric_id,
-                "expression": expression["expression"],
-                "configHash": expression["config_hash"],
-            }
-        ),
-        content_type="application/json",
+    return json_response(
+        {
+            "transformerId": transformer_id,
+            "metric": metric_id,
+            "expression": expression["expression"],
+            "configHash": expression["config_hash"],
+        }
     )
 
 
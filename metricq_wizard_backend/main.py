@@ -31,7 +31,10 @@ from aiohttp_session.cookie_storage import EncryptedCookieStorage
 from aiohttp_swagger import setup_swagger
 
 from . import api
+from .api.response_cache import ResponseCache
+from .api.serialization import json_response, set_encoder
 from .metricq import Configurator, ClusterScanner
+from .metricq.rabbitmq import BindingsUnavailable
 from .metricq.source_plugin import AddMetricItem, AvailableMetricItem, ConfigItem
 from .settings import Settings
 
@@ -46,6 +49,12 @@ async def startup(app: web.Application):
         settings.couchdb_url,
         settings.rabbitmq_api_url,
         settings.rabbitmq_data_host,
+        metadata_index=settings.metadata_index,
+        bindings_refresh_interval=settings.bindings_refresh_interval,
+        config_cache=settings.config_cache,
+        shared_state_dir=settings.shared_state_dir,
+        session_ttl=settings.session_ttl,
+        max_sessions=settings.max_sessions,
     )
 
     cluster_scanner = ClusterScanner(
@@ -53,6 +62,11 @@ async def startup(app: web.Application):
         url=settings.rabbitmq_url,
         couchdb=settings.couchdb_url,
         ignore_patterns=settings.metric_scanner_ignore_patterns,
+        max_concurrency_per_database=settings.metric_scanner_max_concurrency_per_database,
+        rate_per_database=settings.metric_scanner_rate_per_database,
+        target_latency=settings.metric_scanner_target_latency,
+        incremental=settings.metric_scanner_incremental,
+        checks_per_second=settings.metric_scanner_checks_per_second,
     )
     app["metricq_client"] = client
     app["cluster_scanner"] = cluster_scanner
@@ -70,10 +84,26 @@ async def cleanup(app: web.Application):
     return
 
 
+@web.middleware
+async def service_unavailable(request: web.Request, handler):
+    try:
+        return await handler(request)
+    except BindingsUnavailable as e:
+        return json_response({"status": "error", "message": str(e)}, status=503)
+
+
 async def create_app():
-    app = web.Application()
+    app = web.Application(middlewares=[service_unavailable])
     settings = Settings()
-    app.update(settings=settings, static_root_url="/static/")
+    set_encoder(settings.json_encoder)
+    app.update(
+        settings=settings,
+        static_root_url="/static/",
+        response_cache=ResponseCache(
+            max_entries=settings.response_cache_max_entries,
+            max_bytes=settings.response_cache_max_bytes,
+        ),
+    )
 
     jinja2_loader = jinja2.FileSystemLoader(str(THIS_DIR / "templates"))
     aiohttp_jinja2.setup(app, loader=jinja2_loader)
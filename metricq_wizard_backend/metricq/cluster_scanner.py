@@ -1,16 +1,34 @@
 import asyncio
+import heapq
 import math
+import random
 import re
+import time
 import traceback
-from contextlib import suppress
-from typing import Any, Coroutine, Literal, cast
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import asynccontextmanager, suppress
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Coroutine,
+    Literal,
+    TypeVar,
+    cast,
+)
 
 from aiocouch import CouchDB, Database, View
 from metricq import HistoryClient, Timedelta, Timestamp
 from metricq.exceptions import HistoryError
 from metricq.logging import get_logger
 
+from .couchdb import poll_changes
+from .issue_writer import IssueReportWriter
+
 JsonDict = dict[str, Any]
+T = TypeVar("T")
 
 logger = get_logger()
 logger.setLevel("INFO")
@@ -31,57 +49,197 @@ IssueType = (
 )
 
 
-class AsyncTaskPool:
-    def __init__(self, max_tasks: int, timeout: float = 0.1):
-        self.max_tasks = max_tasks
-        self.timeout = timeout
-        self.pending: set[asyncio.Task] = set()
+class LatencyHistogram:
+    # upper bounds of the buckets in seconds, the last bucket is unbounded
+    BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60)
 
-    async def append(self, coro: Coroutine) -> None:
-        assert len(self.pending) <= self.max_tasks
+    def __init__(self) -> None:
+        self.counts = [0] * (len(self.BUCKETS) + 1)
+        self.total = 0.0
+        self.errors = 0
+
+    def add(self, latency: float, failed: bool = False) -> None:
+        self.counts[bisect_left(self.BUCKETS, latency)] += 1
+        self.total += latency
+        if failed:
+            self.errors += 1
+
+    @property
+    def count(self) -> int:
+        return sum(self.counts)
+
+    def json(self) -> JsonDict:
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "mean": self.total / self.count if self.count else None,
+            "buckets": {
+                str(bound): count
+                for bound, count in zip((*self.BUCKETS, "inf"), self.counts)
+            },
+        }
 
-        # Once there are enough pending tasks, we will wait for the timeout.
-        # Ideally, we make a good chunk of progress
-        while len(self.pending) == self.max_tasks:
-            done, pending = await asyncio.wait(
-                self.pending,
-                timeout=self.timeout,
-                return_when=asyncio.ALL_COMPLETED,
-            )
 
-            assert self.pending == done | pending
-            self.pending = pending
+class TaskExecutor:
+    """
+    A fixed number of workers running the health check tasks.
 
-            # fetch all results of the done tasks.
-            for task in done:
-                try:
-                    task.result()
-                except Exception as e:
-                    # this should never be CancelledError or InvalidStateError
-                    # besides strange cancelling on shutdown.
-                    # Other exceptions we will just log and forget about. We
-                    # have other fish to fry.
-                    logger.error("Failed to complete health check task: ", e)
-                    traceback.print_exception(e)
+    Tasks are submitted to a bounded queue, so the producer is slowed down
+    once all workers are busy and the queue is full. Each task is tagged
+    with a kind, for which the executor keeps a latency histogram.
+    """
+
+    def __init__(self, workers: int, queue_size: int | None = None):
+        self.queue: asyncio.Queue[tuple[str, Coroutine]] = asyncio.Queue(
+            maxsize=workers if queue_size is None else queue_size
+        )
+        self.histograms: dict[str, LatencyHistogram] = defaultdict(LatencyHistogram)
+        # every task, that was submitted, but is not done yet
+        self.busy = 0
+        self._workers = [asyncio.create_task(self._work()) for _ in range(workers)]
 
-        self.pending.add(asyncio.create_task(coro))
+    async def submit(self, coro: Coroutine, kind: str = "task") -> None:
+        await self.queue.put((kind, coro))
+        self.busy += 1
+
+    def _task_done(self) -> None:
+        self.busy -= 1
+        self.queue.task_done()
 
     async def completed(self) -> None:
-        if len(self.pending) == 0:
-            return
+        """Waits until all submitted tasks are done"""
+        await self.queue.join()
 
-        # We don't stop on exceptions. We want all tasks to complete, be it
-        # successful or not.
-        results = await asyncio.gather(*self.pending, return_exceptions=True)
+    async def stop(self) -> None:
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+
+        # close what never got to run, to avoid warnings about coroutines
+        # that were never awaited
+        while not self.queue.empty():
+            _, coro = self.queue.get_nowait()
+            coro.close()
+            self._task_done()
+
+    def stats(self) -> JsonDict:
+        return {
+            "busy": self.busy,
+            "queued": self.queue.qsize(),
+            "tasks": {kind: hist.json() for kind, hist in self.histograms.items()},
+        }
 
-        for result in results:
-            if isinstance(result, Exception):
-                logger.error("Failed to complete health check task: ", result)
-                traceback.print_exception(result)
+    async def _work(self) -> None:
+        while True:
+            kind, coro = await self.queue.get()
+            failed = False
+            start = time.monotonic()
+            try:
+                await coro
+            except asyncio.CancelledError:
+                self._task_done()
+                raise
+            except Exception as e:
+                # Exceptions we will just log and forget about. We have other
+                # fish to fry.
+                failed = True
+                logger.error(f"Failed to complete health check task: {e}")
+                traceback.print_exception(e)
+
+            self.histograms[kind].add(time.monotonic() - start, failed)
+            self._task_done()
+
+
+class DatabaseLimiter:
+    """
+    Limits the history requests we send to a single database.
+
+    The number of concurrent requests adapts to the observed latency: it
+    grows additively while requests are answered within `target_latency`
+    and is halved on slow or timed out requests. On top of that, requests
+    are started at most at `rate` per second.
+    """
+
+    def __init__(
+        self,
+        *,
+        max_concurrency: int,
+        rate: float,
+        target_latency: float,
+        initial_concurrency: int = 4,
+    ):
+        self.max_concurrency = max_concurrency
+        self.rate = rate
+        self.target_latency = target_latency
+
+        self.concurrency = float(min(initial_concurrency, max_concurrency))
+        self.in_flight = 0
+
+        self._condition = asyncio.Condition()
+        self._next_start = time.monotonic()
+        self._last_decrease = 0.0
+        # keeps the tasks waking up waiting requests alive
+        self._wakeups: set[asyncio.Task] = set()
+
+    @asynccontextmanager
+    async def request(self) -> AsyncIterator[None]:
+        async with self._condition:
+            await self._condition.wait_for(
+                lambda: self.in_flight < int(self.concurrency)
+            )
+            self.in_flight += 1
 
-        assert all(task.done() for task in self.pending)
+            # token bucket with a bucket size of one
+            now = time.monotonic()
+            delay = self._next_start - now
+            self._next_start = max(now, self._next_start) + 1 / self.rate
 
-        self.pending = set()
+        timed_out = False
+        cancelled = False
+        start = time.monotonic()
+        try:
+            if delay > 0:
+                await asyncio.sleep(delay)
+                start = time.monotonic()
+            yield
+        except asyncio.TimeoutError:
+            timed_out = True
+            raise
+        except asyncio.CancelledError:
+            cancelled = True
+            raise
+        finally:
+            # Nothing in here may await, if we got cancelled once more while
+            # waiting, the slot would stay taken for good.
+            self.in_flight -= 1
+            if not cancelled:
+                # a cancelled request tells nothing about the database
+                self._adapt(time.monotonic() - start, timed_out)
+            self._wake_up_waiting()
+
+    def _adapt(self, latency: float, timed_out: bool) -> None:
+        if timed_out or latency > self.target_latency:
+            # All the requests in flight have seen the same overload, so we
+            # only back off once per round trip.
+            now = time.monotonic()
+            if now - self._last_decrease > latency:
+                self.concurrency = max(1.0, self.concurrency / 2)
+                self._last_decrease = now
+        else:
+            self.concurrency = min(
+                float(self.max_concurrency),
+                self.concurrency + 1 / self.concurrency,
+            )
+
+    def _wake_up_waiting(self) -> None:
+        async def notify() -> None:
+            async with self._condition:
+                self._condition.notify_all()
+
+        # a task of its own, so it is not cancelled along with the request
+        task = asyncio.create_task(notify())
+        self._wakeups.add(task)
+        task.add_done_callback(self._wakeups.discard)
 
 
 def issue_report_id(issue_type: IssueType, scope_type: ScopeType, scope: str) -> str:
@@ -89,24 +247,73 @@ def issue_report_id(issue_type: IssueType, scope_type: ScopeType, scope: str) ->
 
 
 class ClusterScanner:
-    def __init__(self, token: str, url: str, couchdb: str, ignore_patterns: list[str]):
+    def __init__(
+        self,
+        token: str,
+        url: str,
+        couchdb: str,
+        ignore_patterns: list[str],
+        max_concurrency_per_database: int = 32,
+        rate_per_database: float = 100,
+        target_latency: float = 5,
+        timeout_retries: int = 1,
+        incremental: bool = False,
+        liveness_check_delay: float = 10,
+        issue_flush_interval: float = 5,
+        checks_per_second: float = 50,
+        max_checks_in_flight: int = 250,
+    ):
         self.token = token
         self.url = url
         self.couch: CouchDB = CouchDB(couchdb)
 
         self.ignore_patterns = [re.compile(pattern) for pattern in ignore_patterns]
 
+        self.max_concurrency_per_database = max_concurrency_per_database
+        self.rate_per_database = rate_per_database
+        self.target_latency = target_latency
+        self.timeout_retries = timeout_retries
+
+        self.incremental = incremental
+        self.liveness_check_delay = liveness_check_delay
+        self.issue_flush_interval = issue_flush_interval
+        self.checks_per_second = checks_per_second
+        self.max_checks_in_flight = max_checks_in_flight
+
+        self.db_config: Database | None = None
         self.db_issues: Database | None = None
         self.db_metadata: Database | None = None
+        self.issue_writer: IssueReportWriter | None = None
+
+        # the database token for each historic metric, updated for each scan
+        self.database_by_metric: dict[str, str] = {}
+        self.limiters: dict[str, DatabaseLimiter] = {}
+
+        # the last sequence of the metadata _changes feed, that was checked
+        self.sequence: str | None = None
+        self._incremental_task: asyncio.Task | None = None
+
+        # the schedule of liveness checks, a heap of (due time, metric)
+        self._due: list[tuple[float, str]] = []
+        self._due_times: dict[str, float] = {}
+        self._due_metadata: dict[str, JsonDict] = {}
+        # metric => due time of its check, that is running right now
+        self._checking: dict[str, float] = {}
+        self._schedule_changed = asyncio.Event()
+
+        # the executors of the running scans, kept for their statistics
+        self.executors: dict[str, TaskExecutor] = {}
 
         self.lock: asyncio.Lock | None = None
 
     async def connect(self):
         self.lock = asyncio.Lock()
 
+        self.db_config = await self.couch.create("config", exists_ok=True)
         self.db_metadata = await self.couch.create("metadata", exists_ok=True)
 
         self.db_issues = await self.couch.create("issues", exists_ok=True)
+        self.issue_writer = IssueReportWriter(self.db_issues)
 
         index = await self.db_issues.design_doc("sortedBy", exists_ok=True)
         await index.create_view(
@@ -125,9 +332,20 @@ class ClusterScanner:
             exists_ok=True,
         )
 
+        if self.incremental:
+            self._incremental_task = asyncio.create_task(self._run_incremental())
+
     async def stop(self) -> None:
+        if self._incremental_task is not None:
+            self._incremental_task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._incremental_task
         await self.couch.close()
 
+    @property
+    def incremental_running(self) -> bool:
+        return self._incremental_task is not None and not self._incremental_task.done()
+
     @property
     def running(self) -> bool:
         assert self.lock is not None
@@ -147,37 +365,341 @@ class ClusterScanner:
             finally:
                 logger.warn("Cluster Health Scan Finished")
 
+    async def update_database_assignment(self) -> None:
+        """Reads from the db-* configs, which database stores which metric"""
+        assert self.db_config is not None
+
+        database_by_metric = {}
+        async for config in self.db_config.docs(prefix="db-"):
+            metrics = config.get("metrics", {})
+            if not isinstance(metrics, dict):
+                logger.error(
+                    f"Config of database {config.id} is incorrect! 'metrics' is not a dict"
+                )
+                continue
+
+            for metric in metrics:
+                database_by_metric[metric] = config.id
+
+        self.database_by_metric = database_by_metric
+
+    def _limiter(self, metric: str) -> DatabaseLimiter:
+        # metrics, that aren't in any db config, share one limiter
+        database = self.database_by_metric.get(metric, "")
+        limiter = self.limiters.get(database)
+        if limiter is None:
+            limiter = DatabaseLimiter(
+                max_concurrency=self.max_concurrency_per_database,
+                rate=self.rate_per_database,
+                target_latency=self.target_latency,
+            )
+            self.limiters[database] = limiter
+        return limiter
+
+    async def _history_request(
+        self, metric: str, request: Callable[[], Awaitable[T]]
+    ) -> T:
+        """
+        Sends a history request for the metric through the limiter of its
+        database. Timeouts are retried, as they are most likely caused by
+        an overloaded database and the limiter just backed off.
+        """
+        limiter = self._limiter(metric)
+        attempt = 0
+        while True:
+            try:
+                async with limiter.request():
+                    return await request()
+            except asyncio.TimeoutError:
+                attempt += 1
+                if attempt > self.timeout_retries:
+                    raise
+
     async def _run_scan(self) -> None:
         assert self.db_metadata is not None
+        assert self.issue_writer is not None
+
+        info, *_ = await asyncio.gather(
+            self.db_metadata.info(),
+            self.update_database_assignment(),
+            self.issue_writer.load(),
+        )
 
         async with HistoryClient(self.token, self.url, add_uuid=True) as client:
-            tasks = AsyncTaskPool(max_tasks=250)
+            tasks = TaskExecutor(workers=self.max_checks_in_flight)
+            self.executors["scan"] = tasks
 
-            async for doc in self.db_metadata.docs():
-                metric = doc.id
-                metadata = doc.data
+            try:
 
-                # this assert is purely for mypy. doc.data can only return None
-                # if the doc does not exist. It clearly exists, as we only
-                # get existing documents from the docs iterator.
-                assert metadata is not None
+                async for doc in self.db_metadata.docs():
+                    metric = doc.id
+                    metadata = doc.data
 
-                await tasks.append(self.check_metric_metadata(metric, metadata))
+                    # this assert is purely for mypy. doc.data can only return None
+                    # if the doc does not exist. It clearly exists, as we only
+                    # get existing documents from the docs iterator.
+                    assert metadata is not None
 
-                if metadata.get("historic", False):
-                    # Only check the db status for historic metrics
-                    await tasks.append(
-                        self.check_metric_is_dead(client, metric, metadata)
+                    await tasks.submit(
+                        self.check_metric_metadata(metric, metadata), kind="metadata"
                     )
-                    await tasks.append(
-                        self.check_metric_for_infinites(client, metric, metadata)
+
+                    if metadata.get("historic", False):
+                        # Only check the db status for historic metrics
+                        await tasks.submit(
+                            self.check_metric_is_dead(client, metric, metadata),
+                            kind="dead",
+                        )
+                        await tasks.submit(
+                            self.check_metric_for_infinites(client, metric, metadata),
+                            kind="infinites",
+                        )
+
+                    # there is no tooling for renaming metrics, so bad
+                    # names is nothing we should warn about yet.
+                    # await tasks.submit(self.check_metric_name(metric))
+
+                await tasks.completed()
+            finally:
+                await tasks.stop()
+
+        await self.issue_writer.flush()
+
+        if self.sequence is None:
+            # Everything up to the start of this scan was checked, the
+            # incremental scan can take it from there.
+            self.sequence = info["update_seq"]
+
+    async def _run_incremental(self) -> None:
+        """
+        Checks metrics continuously instead of all at once.
+
+        check_metric_metadata runs for every document in the metadata
+        _changes feed. The liveness checks for historic metrics are kept in
+        a priority queue by their due time. Each metric is due again one
+        allowed age after its last check, and freshly declared metrics are
+        due within seconds. The checks are started at a steady rate of
+        `checks_per_second`, so the load on the databases stays flat.
+        """
+        assert self.db_metadata is not None
+        assert self.issue_writer is not None
+
+        if self.sequence is None:
+            self.sequence = (await self.db_metadata.info())["update_seq"]
+
+        if not self.issue_writer.loaded:
+            await self.issue_writer.load()
+
+        await self.update_database_assignment()
+
+        async with HistoryClient(self.token, self.url, add_uuid=True) as client:
+            await asyncio.gather(
+                self._populate_schedule(),
+                self._follow_metadata_changes(),
+                self._run_schedule(client),
+                self._flush_issue_reports(),
+            )
+
+    async def _populate_schedule(self) -> None:
+        assert self.db_metadata is not None
+
+        # Spread the first check of each metric over its allowed age, so we
+        # don't start with a burst.
+        try:
+            async for doc in self.db_metadata.docs():
+                metadata = doc.data
+                assert metadata is not None
+                if metadata.get("historic", False) and doc.id not in self._due_times:
+                    self._schedule_liveness_check(
+                        doc.id,
+                        metadata,
+                        delay=random.uniform(0, self._guess_allowed_age(metadata).s),
                     )
+        except Exception:
+            # the metrics will still be scheduled once their metadata changes
+            logger.exception("Failed to schedule the liveness checks")
+
+    async def _follow_metadata_changes(self) -> None:
+        assert self.db_metadata is not None
+
+        while True:
+            try:
+                async for event in poll_changes(
+                    self.db_metadata, self.sequence, include_docs=True
+                ):
+                    change = event.json
+                    if "id" not in change:
+                        continue
+
+                    metric = change["id"]
+                    metadata = change.get("doc")
+                    if metric.startswith("_"):
+                        pass
+                    elif change.get("deleted", False) or metadata is None:
+                        self._unschedule_liveness_check(metric)
+                    else:
+                        await self.check_metric_metadata(metric, metadata)
+                        if metadata.get("historic", False):
+                            self._schedule_liveness_check(metric, metadata)
+                        else:
+                            self._unschedule_liveness_check(metric)
+
+                    self.sequence = change["seq"]
+                # the poll returned, ask right away for the next changes
+                continue
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Following the metadata _changes feed failed")
+
+            await asyncio.sleep(5)
+
+    async def _flush_issue_reports(self) -> None:
+        assert self.issue_writer is not None
+
+        while True:
+            await asyncio.sleep(self.issue_flush_interval)
+            try:
+                await self.issue_writer.flush()
+            except Exception:
+                logger.exception("Failed to write issue reports")
+
+    def _liveness_check_delay(self, metadata: JsonDict) -> float:
+        # give the metric time to send a couple of data points first
+        delay = self.liveness_check_delay
+        rate = metadata.get("rate")
+        if isinstance(rate, (int, float)) and rate > 0:
+            delay += 2 / rate
+        return min(delay, self._guess_allowed_age(metadata).s)
+
+    def _schedule_liveness_check(
+        self, metric: str, metadata: JsonDict, delay: float | None = None
+    ) -> None:
+        if delay is None:
+            delay = self._liveness_check_delay(metadata)
+
+        due = time.monotonic() + delay
+        # Previous entries of the metric stay in the queue, but are skipped,
+        # as their due time doesn't match anymore.
+        self._due_times[metric] = due
+        self._due_metadata[metric] = metadata
+        heapq.heappush(self._due, (due, metric))
+        self._schedule_changed.set()
+
+    def _unschedule_liveness_check(self, metric: str) -> None:
+        self._due_times.pop(metric, None)
+        self._due_metadata.pop(metric, None)
+        # a running check must not schedule the metric again
+        self._checking.pop(metric, None)
+
+    def stats(self) -> JsonDict:
+        return {
+            "executors": {
+                name: executor.stats() for name, executor in self.executors.items()
+            },
+            "databases": {
+                database: {
+                    "concurrency": limiter.concurrency,
+                    "inFlight": limiter.in_flight,
+                }
+                for database, limiter in self.limiters.items()
+            },
+        }
 
-                # there is no tooling for renaming metrics, so bad
-                # names is nothing we should warn about yet.
-                # await tasks.append(self.check_metric_name(metric))
+    @property
+    def scheduled_checks(self) -> int:
+        return len(self._due_times)
+
+    @property
+    def schedule_lag(self) -> float:
+        """How many seconds the next due check is overdue"""
+        # Reading a statistic must not change the schedule, so instead of
+        # popping the stale entries off the heap, we look at all due times.
+        due = min(self._due_times.values(), default=None)
+        if due is None:
+            return 0
+        return max(0, time.monotonic() - due)
+
+    def _prune_due(self) -> None:
+        """Drops the stale entries from the top of the schedule"""
+        while self._due and self._due_times.get(self._due[0][1]) != self._due[0][0]:
+            heapq.heappop(self._due)
+
+    async def _run_schedule(self, client: HistoryClient) -> None:
+        tasks = TaskExecutor(workers=self.max_checks_in_flight)
+        self.executors["incremental"] = tasks
+        try:
+            await self._dispatch_schedule(client, tasks)
+        finally:
+            await tasks.stop()
+
+    async def _dispatch_schedule(
+        self, client: HistoryClient, tasks: TaskExecutor
+    ) -> None:
+        interval = 1 / self.checks_per_second
+        next_start = time.monotonic()
+
+        while True:
+            self._prune_due()
+            if not self._due:
+                self._schedule_changed.clear()
+                await self._schedule_changed.wait()
+                continue
+
+            due, metric = self._due[0]
+
+            wait = max(due, next_start) - time.monotonic()
+            if wait > 0:
+                # something may get due earlier in the meantime
+                self._schedule_changed.clear()
+                with suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(self._schedule_changed.wait(), wait)
+                continue
+
+            heapq.heappop(self._due)
+            del self._due_times[metric]
+            metadata = self._due_metadata.pop(metric)
+            self._checking[metric] = due
+
+            # If we fall behind, we don't try to catch up with a burst.
+            next_start = max(next_start + interval, time.monotonic())
+
+            await tasks.submit(
+                self._scheduled_liveness_check(client, metric, metadata, due),
+                kind="liveness",
+            )
+
+    async def _scheduled_liveness_check(
+        self, client: HistoryClient, metric: str, metadata: JsonDict, due: float
+    ) -> None:
+        try:
+            await self._check_liveness(client, metric, metadata)
+        finally:
+            # If the metric was unscheduled in the meantime, or another check
+            # of it started, this check is not responsible anymore.
+            responsible = self._checking.get(metric) == due
+            if responsible:
+                del self._checking[metric]
+
+        # The metric could have been rescheduled in the meantime, otherwise
+        # check again once the last value could be too old.
+        if responsible and metric not in self._due_times:
+            self._schedule_liveness_check(
+                metric, metadata, delay=self._guess_allowed_age(metadata).s
+            )
 
-            await tasks.completed()
+    async def _check_liveness(
+        self, client: HistoryClient, metric: str, metadata: JsonDict
+    ) -> None:
+        results = await asyncio.gather(
+            self.check_metric_is_dead(client, metric, metadata),
+            self.check_metric_for_infinites(client, metric, metadata),
+            return_exceptions=True,
+        )
+        for result in results:
+            if isinstance(result, Exception):
+                logger.error("Failed to complete health check task: ", result)
+                traceback.print_exception(result)
 
     async def create_issue_report(
         self,
@@ -235,11 +757,14 @@ class ClusterScanner:
 
     async def delete_issue_report_by(self, id: str):
         assert self.db_issues is not None
+        assert self.issue_writer is not None
         report = await self.db_issues.get(id)
         await report.delete()
+        self.issue_writer.forget(id)
 
     async def delete_issue_reports(self, scope_type: ScopeType, scope: str):
         assert self.db_issues is not None
+        assert self.issue_writer is not None
 
         async for report in self.db_issues.find(
             {
@@ -247,7 +772,9 @@ class ClusterScanner:
                 "scope_type": scope_type,
             }
         ):
+            id = report.id
             await report.delete()
+            self.issue_writer.forget(id)
 
     async def handle_issue_report(
         self,
@@ -258,17 +785,28 @@ class ClusterScanner:
         severity: SeverityType | None = None,
         **kwargs: Any,
     ):
+        # The reports are collected by the writer and written in batches,
+        # make sure to flush it at the end of the scan.
+        assert self.issue_writer is not None
+
         ignored = False
 
         if scope_type == "metric":
             ignored = any(pattern.fullmatch(scope) for pattern in self.ignore_patterns)
 
+        id = issue_report_id(issue_type, scope_type, scope)
+
         if create_condition and not ignored:
-            await self.create_issue_report(
-                issue_type, scope_type, scope, severity, **kwargs
+            await self.issue_writer.update(
+                id,
+                severity="warning" if severity is None else severity,
+                type=issue_type,
+                scope_type=scope_type,
+                scope=scope,
+                **kwargs,
             )
         else:
-            await self.delete_issue_report(issue_type, scope_type, scope)
+            await self.issue_writer.delete(id)
 
     async def check_metric_metadata(self, metric: str, metadata: JsonDict):
         source = metadata.get("source")
@@ -376,7 +914,9 @@ class ClusterScanner:
         request_start_time = Timestamp.now()
 
         try:
-            result = await client.history_last_value(metric, timeout=60)
+            result = await self._history_request(
+                metric, lambda: client.history_last_value(metric, timeout=60)
+            )
             request_end_time = Timestamp.now()
         except TimeoutError:
             has_timed_out = True
@@ -483,11 +1023,14 @@ class ClusterScanner:
         error_msg = None
 
         try:
-            result = await client.history_aggregate(
+            result = await self._history_request(
                 metric,
-                start_time=start_time,
-                end_time=end_time,
-                timeout=60,
+                lambda: client.history_aggregate(
+                    metric,
+                    start_time=start_time,
+                    end_time=end_time,
+                    timeout=60,
+                ),
             )
 
         except asyncio.TimeoutError:
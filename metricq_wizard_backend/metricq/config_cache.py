@@ -0,0 +1,178 @@
+# metricq-wizard
+# Copyright (C) 2026 ZIH, CIDS, Technische Universitaet Dresden,
+#                    Federal Republic of Germany
+#
+# All rights reserved.
+#
+# This file is part of metricq-wizard.
+#
+# metricq-wizard is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# metricq-wizard is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with metricq-wizard.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import hashlib
+from typing import Any, Callable, Optional
+
+from aiocouch import Database
+from metricq.logging import get_logger
+
+from .couchdb import poll_changes
+
+JsonDict = dict[str, Any]
+
+# called with the token and the new config, or None if it was deleted
+ConfigListener = Callable[[str, Optional[JsonDict]], None]
+
+logger = get_logger()
+logger.setLevel("INFO")
+
+
+def _generation(rev: Optional[str]) -> int:
+    if not rev:
+        return 0
+    return int(rev.split("-", 1)[0])
+
+
+class ConfigCache:
+    """
+    A resident copy of the ``config`` database.
+
+    Like the :class:`MetadataIndex`, the cache is bootstrapped once and
+    afterwards follows the ``_changes`` feed. Our own writes are put into the
+    cache right away, so we don't have to wait for the feed to see them.
+
+    The configs handed out are shared and must not be modified by the caller.
+    """
+
+    def __init__(self, db: Database, retry_interval: float = 5):
+        self.db = db
+        self.retry_interval = retry_interval
+
+        self.configs: dict[str, JsonDict] = {}
+        self._version: Optional[str] = None
+
+        # the last sequence of the _changes feed, that we have seen
+        self.sequence: Optional[str] = None
+
+        self._listeners: list[ConfigListener] = []
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def ready(self) -> bool:
+        return self.sequence is not None
+
+    @property
+    def version(self) -> str:
+        """
+        A digest of the revisions of all configs. It includes our own writes
+        right away, and is the same in every process with the same configs.
+        """
+        if self._version is None:
+            digest = hashlib.blake2b(digest_size=12)
+            for token, config in sorted(self.configs.items()):
+                digest.update(f"{token}\0{config.get('_rev')}\0".encode())
+            self._version = digest.hexdigest()
+        return self._version
+
+    async def start(self) -> None:
+        info = await self.db.info()
+        sequence = info["update_seq"]
+
+        async for doc in self.db.docs():
+            if not doc.id.startswith("_"):
+                self.configs[doc.id] = doc.data
+
+        self.sequence = sequence
+        self._version = None
+        logger.info(f"Config cache bootstrapped with {len(self.configs)} configs")
+
+        self._task = asyncio.create_task(self._follow())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _follow(self) -> None:
+        while True:
+            try:
+                async for event in poll_changes(
+                    self.db, self.sequence, include_docs=True
+                ):
+                    self._apply_change(event.json)
+                # the poll returned, ask right away for the next changes
+                continue
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Following the config _changes feed failed")
+
+            await asyncio.sleep(self.retry_interval)
+
+    def _apply_change(self, change: JsonDict) -> None:
+        if "id" not in change:
+            return
+
+        token = change["id"]
+        if not token.startswith("_"):
+            config = None if change.get("deleted", False) else change.get("doc")
+            if self.put(token, config):
+                for listener in self._listeners:
+                    listener(token, config)
+
+        self.sequence = change["seq"]
+
+    def add_listener(self, listener: ConfigListener) -> None:
+        """
+        `listener` is called for changes from the feed, that weren't put into
+        the cache before, i.e. changes made by someone else.
+        """
+        self._listeners.append(listener)
+
+    def __contains__(self, token: str) -> bool:
+        return token in self.configs
+
+    def get(self, token: str) -> Optional[JsonDict]:
+        return self.configs.get(token)
+
+    def put(self, token: str, config: Optional[JsonDict]) -> bool:
+        """
+        Stores a config, that was just written or read, unless we already
+        have the same or a newer revision of it. Pass None for deleted
+        configs.
+
+        Returns whether the cache changed.
+        """
+        current = self.configs.get(token)
+
+        if config is None:
+            if current is None:
+                return False
+            del self.configs[token]
+            self._version = None
+            return True
+
+        if current is not None:
+            rev, current_rev = config.get("_rev"), current.get("_rev")
+            if rev == current_rev or _generation(rev) < _generation(current_rev):
+                # The feed can lag behind our own writes, so this is either
+                # the echo of a write or an outdated revision.
+                return False
+
+        self.configs[token] = config
+        self._version = None
+        return True
@@ -18,6 +18,7 @@
 # You should have received a copy of the GNU General Public License
 # along with metricq-wizard.  If not, see <http://www.gnu.org/licenses/>.
 import asyncio
+import copy
 import datetime
 import functools
 import hashlib
@@ -27,21 +28,59 @@ import re
 from asyncio import Lock, gather
 from collections import defaultdict
 from itertools import islice
-from typing import Any, Dict, List, Optional, Sequence, Union
+from typing import (
+    Any,
+    AsyncIterator,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Union,
+)
 
 import metricq
 from aiocache import SimpleMemoryCache, cached
-from aiocouch import ConflictError, CouchDB, Document, database
+from aiocouch import (
+    BadRequestError,
+    ConflictError,
+    CouchDB,
+    Document,
+    NotFoundError,
+    database,
+)
+from aiocouch.view import View
 from metricq import Agent, Client
 from metricq.logging import get_logger
 
 from metricq_wizard_backend.api.models import MetricDatabaseConfiguration
 from metricq_wizard_backend.metricq.cluster_scanner import ClusterScanner
+from metricq_wizard_backend.metricq.config_cache import ConfigCache
+from metricq_wizard_backend.metricq.couchdb import (
+    Mutation,
+    MutationStatus,
+    chunked,
+    deleted,
+    merge_changes,
+    mutate_docs,
+)
+from metricq_wizard_backend.metricq.database_index import DATABASE_PREFIX, DatabaseIndex
+from metricq_wizard_backend.metricq.dependency_wheel import DependencyWheel
+from metricq_wizard_backend.metricq.lock_registry import LockRegistry
+from metricq_wizard_backend.metricq.metadata_index import MetadataIndex
+from metricq_wizard_backend.metricq.network import LineageCache
 from metricq_wizard_backend.metricq.session_manager import (
     UserSession,
     UserSessionManager,
 )
+from metricq_wizard_backend.metricq.shared_state import FileLock, SharedState
 from metricq_wizard_backend.metricq.source_plugin import SourcePlugin
+from metricq_wizard_backend.metricq.transformer_index import (
+    TRANSFORMER_PREFIX,
+    TransformerIndex,
+)
 from metricq_wizard_backend.version import version as __version__  # noqa: F401
 
 from . import rabbitmq
@@ -52,6 +91,35 @@ logger.setLevel("INFO")
 
 JsonDict = dict[str, Any]
 
+
+async def _succeeded(statuses: AsyncIterator[tuple[str, str]]) -> list[str]:
+    return [id async for id, status in statuses if status == MutationStatus.OK]
+
+
+def _without_meta(doc: JsonDict) -> JsonDict:
+    """The content of a document, without _id, _rev and friends"""
+    return {key: value for key, value in doc.items() if not key.startswith("_")}
+
+
+class DatabaseAssignment:
+    """The outcomes of :meth:`Configurator.update_metric_database_config`"""
+
+    ADDED = "added"
+    # the metric was added, but setting historic in its metadata failed
+    ADDED_NOT_HISTORIC = "added_not_historic"
+    HISTORIC = "historic"
+    CONFIGURED = "configured"
+    NOT_FOUND = "not_found"
+    NO_DATABASE = "no_database"
+
+
+# the config tokens of the clients of each role start with these prefixes
+CLIENT_ROLE_PREFIXES = {
+    "source": "source-",
+    "transformer": TRANSFORMER_PREFIX,
+    "db": DATABASE_PREFIX,
+}
+
 # Use this if we ever use threads
 # logger.handlers[0].formatter = logging.Formatter(fmt='%(asctime)s %(threadName)-16s %(levelname)-8s %(message)s')
 # logger.handlers[0].formatter = logging.Formatter(
@@ -82,6 +150,12 @@ class Configurator(Client):
         couchdb_url: str,
         rabbitmq_api_url: str,
         rabbitmq_data_host: str,
+        metadata_index: bool = False,
+        bindings_refresh_interval: float = 60,
+        config_cache: bool = False,
+        shared_state_dir: Optional[str] = None,
+        session_ttl: float = 3600,
+        max_sessions: int = 1000,
     ):
         super().__init__(
             token,
@@ -92,15 +166,40 @@ class Configurator(Client):
 
         self.rabbitmq_api_url = rabbitmq_api_url
         self.rabbitmq_data_host = rabbitmq_data_host
+        self.bindings_refresh_interval = bindings_refresh_interval
+        self.bindings: rabbitmq.Bindings | None = None
 
         self.couchdb_db_config: database.Database | None = None
         self.couchdb_db_metadata: database.Database | None = None
         self.couchdb_db_clients: database.Database | None = None
         self.couchdb_db_issues: database.Database | None = None
 
-        self.user_session_manager = UserSessionManager()
+        self._use_metadata_index = metadata_index
+        self.metadata_index: MetadataIndex | None = None
+        self._dependency_wheel: DependencyWheel | None = None
+
+        self._use_config_cache = config_cache
+        self.config_cache: ConfigCache | None = None
+
+        # incremented whenever we change a config, so caches derived from
+        # the configs know when they are outdated
+        self.config_version = 0
+        self.lineage = LineageCache(self)
+        self._transformer_index: TransformerIndex | None = None
+        self._transformer_index_lock = Lock()
+        self._database_index: DatabaseIndex | None = None
+        self._database_index_lock = Lock()
+
+        self.user_session_manager = UserSessionManager(
+            ttl=session_ttl, max_sessions=max_sessions
+        )
+
+        # with several worker processes, they coordinate through this
+        self.shared_state: SharedState | None = None
+        if shared_state_dir is not None:
+            self.shared_state = SharedState(shared_state_dir)
 
-        self._config_locks: dict[str, Lock] = {}
+        self._config_locks = LockRegistry(self._create_config_lock)
 
     async def connect(self):
         # First, connect to couchdb
@@ -130,27 +229,67 @@ class Configurator(Client):
             "issues", exists_ok=True
         )
 
+        self.bindings = rabbitmq.Bindings(
+            api_url=self.rabbitmq_api_url,
+            data_host=self.rabbitmq_data_host,
+            clients=self.couchdb_db_clients,
+            refresh_interval=self.bindings_refresh_interval,
+            shared=self.shared_state,
+        )
+        self.bindings.start()
+
+        if self._use_metadata_index:
+            self.metadata_index = MetadataIndex(self.couchdb_db_metadata)
+            await self.metadata_index.start()
+
+        if self._use_config_cache:
+            self.config_cache = ConfigCache(self.couchdb_db_config)
+            self.config_cache.add_listener(self._update_config_indexes)
+            await self.config_cache.start()
+
         # After that, we do the MetricQ connection stuff
         await super().connect()
 
     async def stop(self, *args, **kwargs):
+        if self.bindings is not None:
+            await self.bindings.stop()
+        if self.metadata_index is not None:
+            await self.metadata_index.stop()
+        if self.config_cache is not None:
+            await self.config_cache.stop()
+        if self.shared_state is not None:
+            self.shared_state.close()
         await self.couchdb_client.close()
         await super().stop(*args, **kwargs)
 
-    @cached(ttl=5 * 60, cache=SimpleMemoryCache)
     async def rabbitmq_bindings(self) -> rabbitmq.Bindings:
-        assert self.couchdb_db_config is not None
-        assert self.couchdb_db_clients is not None
+        assert self.bindings is not None
 
-        return await rabbitmq.fetch_bindings(
-            api_url=self.rabbitmq_api_url,
-            data_host=self.rabbitmq_data_host,
-            configs=self.couchdb_db_config,
-            clients=self.couchdb_db_clients,
-        )
+        # Only the very first requests have to wait for the bindings, after
+        # that, they are refreshed in the background.
+        await self.bindings.ready()
+        return self.bindings
+
+    @property
+    def _metadata_index(self) -> MetadataIndex | None:
+        if self.metadata_index is not None and self.metadata_index.ready:
+            return self.metadata_index
+        return None
+
+    @property
+    def _config_cache(self) -> ConfigCache | None:
+        if self.config_cache is not None and self.config_cache.ready:
+            return self.config_cache
+        return None
 
-    @cached(ttl=5 * 60, cache=SimpleMemoryCache)
     async def fetch_produced_metrics(self, token):
+        if index := self._metadata_index:
+            return index.produced_metrics(token)
+
+        return await self._fetch_produced_metrics(token)
+
+    @cached(ttl=5 * 60, cache=SimpleMemoryCache)
+    async def _fetch_produced_metrics(self, token):
         view = self.couchdb_db_metadata.view("index", "source")
 
         return [metric async for metric in view.ids(prefix=token)]
@@ -158,21 +297,179 @@ class Configurator(Client):
     async def fetch_consumed_metrics(self, token):
         bindings = await self.rabbitmq_bindings()
 
-        return bindings.metrics_by_consumer.get(token, [])
+        return bindings.metrics(token)
 
     async def fetch_consumers(self, metric: str):
         bindings = await self.rabbitmq_bindings()
 
-        return bindings.consumers_by_metric.get(metric, [])
+        return bindings.consumers(metric)
 
     async def fetch_metadata(self, metric_ids):
+        if index := self._metadata_index:
+            return {metric: index.get(metric) for metric in metric_ids}
+
         return {
             doc.id: doc.data
             async for doc in self.couchdb_db_metadata.docs(metric_ids, create=True)
         }
 
-    @measure
+    async def data_version(self, *sources: str) -> str:
+        """
+        A version of the data in the given `sources`, that changes whenever
+        their content may have changed. The sources are the databases
+        "config", "metadata" and "clients", and the "bindings" graph.
+
+        The version is built from shared state only, so all worker processes
+        agree on it as long as they see the same data.
+        """
+        parts: list[Any] = []
+        for source in sources:
+            if source == "metadata":
+                if index := self._metadata_index:
+                    parts.append(index.sequence)
+                else:
+                    parts.append(await self._update_seq(self.couchdb_db_metadata))
+            elif source == "config":
+                if cache := self._config_cache:
+                    # our own writes are in the cache before the feed has them
+                    parts.append(cache.version)
+                else:
+                    parts.append(await self._update_seq(self.couchdb_db_config))
+            elif source == "clients":
+                parts.append(await self._update_seq(self.couchdb_db_clients))
+            elif source == "bindings":
+                bindings = await self.rabbitmq_bindings()
+                parts.append(bindings.version)
+            else:
+                raise ValueError(f"unknown data source {source}")
+
+        return "-".join(map(str, parts))
+
+    @staticmethod
+    async def _update_seq(db: database.Database | None) -> str:
+        assert db is not None
+        return (await db.info())["update_seq"]
+
+    async def dependency_wheel(self) -> DependencyWheel | None:
+        """
+        The materialized dependency wheel, if the metadata index is
+        available. It is built on first use and kept up to date afterwards.
+        """
+        if self._dependency_wheel is None:
+            bindings = await self.rabbitmq_bindings()
+            if index := self._metadata_index:
+                self._dependency_wheel = DependencyWheel(index, bindings)
+
+        return self._dependency_wheel
+
+    async def transformer_index(self) -> TransformerIndex:
+        """
+        The reverse dependencies of all transformer metrics. The index is built
+        from the configs on first use and updated by every config change of
+        the wizard afterwards.
+        """
+        async with self._transformer_index_lock:
+            if self._transformer_index is None:
+                index = TransformerIndex()
+                index.build(await self.read_configs(TRANSFORMER_PREFIX))
+                self._transformer_index = index
+                logger.info(
+                    f"Transformer index built with {len(index)} transformer metrics"
+                )
+
+        return self._transformer_index
+
+    async def database_index(self) -> DatabaseIndex:
+        """
+        Which database stores which metric. Built and kept up to date like
+        the transformer index.
+        """
+        async with self._database_index_lock:
+            if self._database_index is None:
+                index = DatabaseIndex()
+                index.build(await self.read_configs(DATABASE_PREFIX))
+                self._database_index = index
+
+        return self._database_index
+
+    async def fetch_database_configurations(
+        self, metrics: Sequence[str]
+    ) -> dict[str, dict[str, JsonDict]]:
+        """
+        For each database, the configs of those of `metrics` it stores. Every
+        database is included, even if it stores none of them.
+        """
+        index = await self.database_index()
+
+        configurations: dict[str, dict[str, JsonDict]] = {
+            token: {} for token in index.database_tokens
+        }
+        for metric in dict.fromkeys(metrics):
+            for token, metric_config in index.configurations(metric):
+                configurations[token][metric] = metric_config
+
+        return configurations
+
+    async def read_configs(self, prefix: str) -> dict[str, JsonDict]:
+        """All configs, whose token starts with `prefix`"""
+        assert self.couchdb_db_config is not None
+
+        if cache := self._config_cache:
+            return {
+                token: config
+                for token, config in cache.configs.items()
+                if token.startswith(prefix)
+            }
+
+        while True:
+            version = self.config_version
+            configs = {
+                doc.id: doc.data
+                async for doc in self.couchdb_db_config.docs(prefix=prefix)
+            }
+            # If we changed a config while reading, the update could have
+            # missed the index we are about to build, so read again.
+            if version == self.config_version:
+                return configs
+
+    def _config_changed(
+        self, token: str, config: JsonDict | None, metric: str | None = None
+    ) -> None:
+        """
+        Call this after saving or deleting the config of `token`. If only the
+        entry of `metric` changed, pass it to skip reindexing the whole config.
+        """
+        if self.config_cache is not None:
+            # `config` is still the live data of the document, the cache
+            # needs its own copy.
+            self.config_cache.put(token, copy.deepcopy(config))
+
+        self._update_config_indexes(token, config, metric)
+
+    def _update_config_indexes(
+        self, token: str, config: JsonDict | None, metric: str | None = None
+    ) -> None:
+        self.config_version += 1
+
+        if self._database_index is not None:
+            self._database_index.update_config(token, config)
+
+        if self._transformer_index is not None:
+            if metric is None:
+                self._transformer_index.update_config(token, config)
+            else:
+                self._transformer_index.update_metric(
+                    token, metric, ((config or {}).get("metrics") or {}).get(metric)
+                )
+
     async def fetch_dependency_wheel(self) -> list[list[Any]]:
+        if wheel := await self.dependency_wheel():
+            return wheel.result
+
+        return await self._compute_dependency_wheel()
+
+    @measure
+    async def _compute_dependency_wheel(self) -> list[list[Any]]:
         """
         This method produces the data used to draw the dependency
         wheel graph displayed in the Client Overview.
@@ -221,13 +518,49 @@ class Configurator(Client):
         ]
 
     async def read_config(self, token):
+        if (cache := self._config_cache) and token in cache:
+            # callers may drop keys from the config, but not modify the values
+            return dict(cache.get(token))
+
         return (await self.couchdb_db_config[token]).data
 
+    async def _fetch_config(self, token: str) -> JsonDict | Document:
+        """The config of `token`, the result must not be modified"""
+        if (cache := self._config_cache) and token in cache:
+            return cache.get(token)
+
+        return await self.couchdb_db_config[token]
+
     async def get_client_tokens(self) -> List[str]:
+        return await self.list_tokens()
+
+    async def list_tokens(
+        self, prefix: Optional[str] = None, role: Optional[str] = None
+    ) -> List[str]:
+        """
+        Lists the tokens of all configs, optionally only those starting with
+        `prefix` or belonging to clients of `role`, see CLIENT_ROLE_PREFIXES.
+
+        Only the keys are read, not the configs themselves.
+        """
         assert self.couchdb_db_config is not None
+
+        if role is not None:
+            try:
+                prefix = CLIENT_ROLE_PREFIXES[role]
+            except KeyError:
+                raise ValueError(f"Unknown client role: {role}")
+
+        if cache := self._config_cache:
+            return sorted(
+                token
+                for token in cache.configs
+                if token.startswith(prefix or "") and not token.startswith("_")
+            )
+
         return [
             id
-            async for id in self.couchdb_db_config.all_docs.akeys()
+            async for id in self.couchdb_db_config.all_docs.ids(prefix=prefix)
             if not id.startswith("_")
         ]
 
@@ -257,6 +590,21 @@ class Configurator(Client):
                     "Invalid selector type: {}, supported: str, list", type(selector)
                 )
 
+        if cache := self._config_cache:
+            if isinstance(selector, str):
+                pattern = re.compile(selector)
+                tokens = [token for token in cache.configs if pattern.search(token)]
+            elif selector is not None:
+                tokens = [token for token in selector if token in cache]
+            else:
+                tokens = list(cache.configs)
+
+            return {
+                token: cache.configs[token]
+                for token in tokens
+                if not token.startswith("_")
+            }
+
         if selector_dict:
             aiter = self.couchdb_db_config.find(selector_dict)
         else:
@@ -268,14 +616,13 @@ class Configurator(Client):
 
         return configs
 
-    async def _save_backup(self, *, config: Document) -> None:
-        token = config.id
+    async def _save_backup(self, token: str, config: JsonDict) -> None:
         try:
             backup = await self.couchdb_db_config_backups.create(
                 f"backup-{token}-{datetime.datetime.now().isoformat()}"
             )
 
-            backup_data = config.json
+            backup_data = _without_meta(config)
             backup_data["x-metricq-id"] = token
             backup.update(backup_data)
 
@@ -283,33 +630,99 @@ class Configurator(Client):
 
         except Exception as e:
             logger.warn(
-                f"Failed to save configuration backup for `{config.id}` in CouchDB: {e}"
+                f"Failed to save configuration backup for `{token}` in CouchDB: {e}"
             )
 
-    async def set_config(self, token: str, new_config: dict):
+    async def _update_config(
+        self,
+        token: str,
+        update: Callable[[Document], bool],
+        metric: str | None = None,
+        retries: int = 5,
+    ) -> bool:
+        """
+        Applies `update` to the config of `token` and saves it, unless
+        `update` returns False. The config may not exist yet.
+
+        Instead of locking the config, the save only succeeds, if nobody saved
+        another revision since we read it. Otherwise, we read the new revision
+        and apply `update` again, so concurrent changes to different metrics
+        of the same config are all kept. Returns whether the config was saved.
+        """
         assert self.couchdb_db_config is not None
+
+        for attempt in range(retries + 1):
+            config = await self.couchdb_db_config.create(token, exists_ok=True)
+            previous = copy.deepcopy(config.data) if config.exists else None
+
+            if not update(config):
+                return False
+
+            try:
+                if await config.save() is None:
+                    # nothing changed
+                    return True
+            except ConflictError:
+                if attempt == retries:
+                    raise
+                logger.info(f"Config of {token} changed while we updated it, retrying")
+                continue
+
+            if previous is not None:
+                await self._save_backup(token, previous)
+            self._config_changed(token, config.data, metric)
+            return True
+
+        return False
+
+    async def _read_config_revision(self, token: str, rev: str) -> JsonDict | None:
+        """An old revision of a config, None if it is gone"""
+        document = Document(self.couchdb_db_config, token)
+        try:
+            await document.fetch(rev=rev)
+        except (NotFoundError, BadRequestError):
+            return None
+        return _without_meta(document.data)
+
+    async def set_config(self, token: str, new_config: dict):
         arguments = {"token": token, "config": new_config}
         logger.debug(arguments)
 
-        async with self._get_config_lock(token):
-            config = await self.couchdb_db_config[token]
+        ours = _without_meta(new_config)
 
-            if config.exists:
-                await self._save_backup(config=config)
+        # The config `new_config` was derived from. What others changed since
+        # then is kept, unless we changed the same thing.
+        base: Optional[JsonDict] = None
+        if base_rev := new_config.get("_rev"):
+            base = await self._read_config_revision(token, base_rev)
+
+        def replace(config: Document) -> bool:
+            nonlocal base
+            current = _without_meta(config.data)
+            if base is None:
+                # we don't know any better, so we replace what we read first
+                base = current
+            merged = merge_changes(base, ours, current)
 
             for config_key in list(config.keys()):
-                if config_key not in new_config:
+                if config_key not in merged and not config_key.startswith("_"):
                     del config[config_key]
+            config.update(copy.deepcopy(merged))
+            return True
 
-            config.update(new_config)
-
-            await config.save()
-
-        return
+        await self._update_config(token, replace)
 
     async def update_metric_database_config(
         self, metric_database_configurations: List[MetricDatabaseConfiguration]
-    ):
+    ) -> dict[str, str]:
+        """
+        Adds the metrics to the configs of their databases and marks them as
+        historic.
+
+        All metadata is read with a single request and each database config is
+        saved once. Returns the outcome for each metric, see
+        :class:`DatabaseAssignment`.
+        """
         configurations_by_database = defaultdict(list)
         for db_config in metric_database_configurations:
             configurations_by_database[db_config.database_id].append(db_config)
@@ -317,61 +730,116 @@ class Configurator(Client):
         assert self.couchdb_db_config is not None
         assert self.couchdb_db_metadata is not None
 
-        for database_id in configurations_by_database.keys():
-            async with self._get_config_lock(database_id):
-                config = await self.couchdb_db_config[database_id]
-
-                if config.exists:
-                    await self._save_backup(config=config)
-
-                if config:
-                    for metric_database_configuration in configurations_by_database[
-                        database_id
-                    ]:
-                        metadata = await self.couchdb_db_metadata[
-                            metric_database_configuration.id
-                        ]
-
-                        if metadata:
-                            if metadata.get("historic", False):
-                                logger.warn("Metric already in a database. Ignoring!")
-                            else:
-                                if (
-                                    metric_database_configuration.id
-                                    in config["metrics"]
-                                ):
-                                    logger.warn(
-                                        f"Metric already configured for database {metric_database_configuration.database_id}. Ignoring!"
-                                    )
-                                else:
-                                    metric_config = {
-                                        "mode": "RW",
-                                        "interval_min": metric_database_configuration.interval_min.ns,
-                                        "interval_max": metric_database_configuration.interval_max.ns,
-                                        "interval_factor": metric_database_configuration.interval_factor,
-                                    }
-                                    config["metrics"][
-                                        metric_database_configuration.id
-                                    ] = metric_config
-                        else:
-                            logger.warn("Metric not found. Ignoring!")
-
-                    await config.save()
-                else:
-                    logger.warn("Config for database not found!")
+        metadata = {
+            doc.id: doc.data
+            async for doc in self.couchdb_db_metadata.docs(
+                list(
+                    dict.fromkeys(
+                        configuration.id
+                        for configuration in metric_database_configurations
+                    )
+                ),
+                create=True,
+            )
+        }
+
+        results: dict[str, str] = {}
+        added: list[str] = []
+
+        async def assign(
+            database_id: str, configurations: list[MetricDatabaseConfiguration]
+        ) -> None:
+            new_metrics: list[str] = []
+
+            def add_metrics(config: Document) -> bool:
+                new_metrics.clear()
+                if not config.exists:
+                    logger.warn(f"Config for database {database_id} not found!")
+                    for configuration in configurations:
+                        results[configuration.id] = DatabaseAssignment.NO_DATABASE
+                    return False
+
+                if "metrics" not in config:
+                    config["metrics"] = {}
+
+                for configuration in configurations:
+                    metric = configuration.id
+                    result = self._assign_metric(
+                        config["metrics"], configuration, metadata.get(metric)
+                    )
+                    results[metric] = result
+                    if result == DatabaseAssignment.ADDED:
+                        new_metrics.append(metric)
+
+                return bool(new_metrics)
+
+            if await self._update_config(database_id, add_metrics):
+                added.extend(new_metrics)
+
+        # the configs of different databases don't depend on each other
+        await gather(
+            *(
+                assign(database_id, configurations)
+                for database_id, configurations in configurations_by_database.items()
+            )
+        )
+
+        async for metric, status in self.stream_metrics_update_historic(
+            {metric: True for metric in added}
+        ):
+            if status != MutationStatus.OK:
+                results[metric] = DatabaseAssignment.ADDED_NOT_HISTORIC
+
+        return results
+
+    @staticmethod
+    def _assign_metric(
+        metrics: JsonDict,
+        configuration: MetricDatabaseConfiguration,
+        metadata: Optional[JsonDict],
+    ) -> str:
+        if metadata is None:
+            logger.warn(f"Metric {configuration.id} not found. Ignoring!")
+            return DatabaseAssignment.NOT_FOUND
+
+        if metadata.get("historic", False):
+            logger.warn(f"Metric {configuration.id} already in a database. Ignoring!")
+            return DatabaseAssignment.HISTORIC
+
+        if configuration.id in metrics:
+            logger.warn(
+                f"Metric {configuration.id} already configured for database {configuration.database_id}. Ignoring!"
+            )
+            return DatabaseAssignment.CONFIGURED
+
+        metrics[configuration.id] = {
+            "mode": "RW",
+            "interval_min": configuration.interval_min.ns,
+            "interval_max": configuration.interval_max.ns,
+            "interval_factor": configuration.interval_factor,
+        }
+        return DatabaseAssignment.ADDED
+
+    def _create_config_lock(self, token: str) -> Lock | FileLock:
+        if self.shared_state is not None:
+            # also keeps the other worker processes out
+            return self.shared_state.lock(f"config-{token}")
+        return Lock()
 
     def _get_config_lock(self, token):
-        config_lock = self._config_locks.get(token, None)
-        if not config_lock:
-            config_lock = Lock()
-            self._config_locks[token] = config_lock
-        return config_lock
+        return self._config_locks.get(token)
+
+    def stats(self) -> JsonDict:
+        return {
+            "config_locks": self._config_locks.stats(),
+            "user_sessions": self.user_session_manager.stats(),
+        }
 
     async def get_source_plugin(
         self, source_id, session_key: str
     ) -> Optional[SourcePlugin]:
         assert self.couchdb_db_config is not None
-        config = await self.couchdb_db_config[source_id]
+        config = await self._fetch_config(source_id)
         if "type" not in config:
             logger.error(f"No type for source {source_id} provided.")
             return None
@@ -382,7 +850,8 @@ class Configurator(Client):
         if source_plugin is None:
             source_plugin = session.create_source_plugin(
                 source_id,
-                source_config=config,
+                # plugins edit their config in place
+                source_config=copy.deepcopy(dict(config)),
                 rpc_function=self._rpc_for_plugins(client_token=source_id),
             )
 
@@ -399,7 +868,7 @@ class Configurator(Client):
 
     async def get_session_state(self, session_key: str, source_id: str) -> bool | None:
         assert self.couchdb_db_config is not None
-        config = await self.couchdb_db_config[source_id]
+        config = await self._fetch_config(source_id)
         if "type" not in config:
             logger.error(f"No type for source {source_id} provided.")
             return None
@@ -429,6 +898,7 @@ class Configurator(Client):
         async with self._get_config_lock(token):
             config = await self.couchdb_db_config.create(token)
             await config.save()
+            self._config_changed(token, config.data)
 
     async def delete_client(self, *, token: str) -> bool:
         assert self.couchdb_db_config is not None
@@ -443,8 +913,9 @@ class Configurator(Client):
 
             if config.exists:
                 existed = True
-                await self._save_backup(config=config)
+                await self._save_backup(token, config.data)
                 await config.delete()
+                self._config_changed(token, None)
 
             client = await self.couchdb_db_clients.create(token, exists_ok=True)
 
@@ -489,26 +960,17 @@ class Configurator(Client):
 
         return rpc_function
 
-    async def get_metrics(
-        self,
-        selector: Union[str, Sequence[str], None] = None,
-        format: Optional[str] = "array",
-        historic: Optional[bool] = None,
-        timeout: Optional[float] = None,
-        prefix: Optional[str] = None,
-        infix: Optional[str] = None,
-        limit: Optional[int] = None,
-        source: Optional[str] = None,
-    ) -> Union[Sequence[str], Sequence[dict]]:
-        if format not in ("array", "object"):
-            raise AttributeError("unknown format requested: {}".format(format))
-
+    @staticmethod
+    def _metric_selector(
+        selector: Union[str, Sequence[str], None],
+        historic: Optional[bool],
+        prefix: Optional[str],
+        infix: Optional[str],
+    ) -> dict:
+        """Checks the filters of get_metrics and returns the Mango selector"""
         if infix is not None and prefix is not None:
             raise AttributeError('cannot get_metrics with both "prefix" and "infix"')
 
-        if source is not None and historic is not None:
-            raise AttributeError('cannot get_metrics with both "historic" and "source"')
-
         selector_dict = dict()
         if selector is not None:
             if isinstance(selector, str):
@@ -533,16 +995,51 @@ class Configurator(Client):
                     )
                 )
 
+        if selector_dict and (prefix is not None or infix is not None):
+            raise AttributeError(
+                'cannot get_metrics with both "selector" and "prefix" or "infix".'
+            )
+
+        return selector_dict
+
+    async def get_metrics(
+        self,
+        selector: Union[str, Sequence[str], None] = None,
+        format: Optional[str] = "array",
+        historic: Optional[bool] = None,
+        timeout: Optional[float] = None,
+        prefix: Optional[str] = None,
+        infix: Optional[str] = None,
+        limit: Optional[int] = None,
+        source: Optional[str] = None,
+    ) -> Union[Sequence[str], Sequence[dict]]:
+        if format not in ("array", "object"):
+            raise AttributeError("unknown format requested: {}".format(format))
+
+        selector_dict = self._metric_selector(selector, historic, prefix, infix)
+
+        if index := self._metadata_index:
+            ids = index.select(
+                selector=selector,
+                historic=historic,
+                prefix=prefix,
+                infix=infix,
+                source=source,
+                limit=limit,
+            )
+            if format == "array":
+                return ids
+            return {id: index.get(id) for id in ids}
+
+        if source is not None and historic is not None:
+            raise AttributeError('cannot get_metrics with both "historic" and "source"')
+
         # TODO can this be unified without compromising performance?
         # Does this even perform well?
         # ALSO: Async :-[
         if selector_dict:
             if historic is not None:
                 selector_dict["historic"] = historic
-            if prefix is not None or infix is not None:
-                raise AttributeError(
-                    'cannot get_metrics with both "selector" and "prefix" or "infix".'
-                )
             aiter = self.couchdb_db_metadata.find(selector_dict, limit=limit)
             if format == "array":
                 metrics = [doc["_id"] async for doc in aiter]
@@ -595,6 +1092,224 @@ class Configurator(Client):
 
         return metrics
 
+    def iter_metrics(
+        self,
+        selector: Union[str, Sequence[str], None] = None,
+        historic: Optional[bool] = None,
+        prefix: Optional[str] = None,
+        infix: Optional[str] = None,
+        limit: Optional[int] = None,
+        source: Optional[str] = None,
+        page_size: int = 1000,
+        after: Optional[str] = None,
+        descending: bool = False,
+    ) -> AsyncIterator[tuple[str, JsonDict]]:
+        """
+        Like :meth:`get_metrics` with format="object", but yields (id,
+        metadata) pairs while reading the metadata page by page, so the
+        memory needed doesn't depend on the number of metrics.
+
+        The metrics are sorted by id, unless `selector` is a list and neither
+        `after` nor `descending` are given. To continue a listing, pass the
+        last id seen as `after`. That costs the same, no matter how far into
+        the listing it is.
+
+        The filters are checked right away, not on the first iteration.
+        """
+        selector_dict = self._metric_selector(selector, historic, prefix, infix)
+
+        if self._metadata_index is None and source is not None and historic is not None:
+            raise AttributeError('cannot get_metrics with both "historic" and "source"')
+
+        return self._iter_metrics(
+            selector,
+            selector_dict,
+            historic,
+            prefix,
+            infix,
+            limit,
+            source,
+            page_size,
+            after,
+            descending,
+        )
+
+    async def _iter_metrics(
+        self,
+        selector: Union[str, Sequence[str], None],
+        selector_dict: dict,
+        historic: Optional[bool],
+        prefix: Optional[str],
+        infix: Optional[str],
+        limit: Optional[int],
+        source: Optional[str],
+        page_size: int,
+        after: Optional[str],
+        descending: bool,
+    ) -> AsyncIterator[tuple[str, JsonDict]]:
+        if index := self._metadata_index:
+            for id in index.select(
+                selector=selector,
+                historic=historic,
+                prefix=prefix,
+                infix=infix,
+                source=source,
+                limit=limit,
+                after=after,
+                descending=descending,
+            ):
+                metadata = index.get(id)
+                if metadata is not None:
+                    yield id, metadata
+            return
+
+        if infix is not None or (selector_dict and isinstance(selector, str)):
+            # The components views contain duplicates and _find has no stable
+            # order to page by, so these are read in one go.
+            ordered = after is not None or descending
+            metrics = await self.get_metrics(
+                selector=selector,
+                format="object",
+                historic=historic,
+                infix=infix,
+                limit=None if ordered else limit,
+            )
+            ids = list(metrics)
+            if ordered:
+                ids = self._page(sorted(ids, reverse=descending), after, descending)
+            for id in islice(ids, limit):
+                yield id, metrics[id]
+            return
+
+        if selector_dict:
+            ids = list(selector)
+            if after is not None or descending:
+                ids = list(
+                    self._page(sorted(set(ids), reverse=descending), after, descending)
+                )
+
+            count = 0
+            for chunk in chunked(ids, page_size):
+                async for doc in self.couchdb_db_metadata.docs(
+                    list(chunk), create=True
+                ):
+                    if not doc.exists:
+                        continue
+                    if historic is not None and doc.get("historic", False) != historic:
+                        continue
+                    if limit is not None and count >= limit:
+                        return
+                    count += 1
+                    yield doc.id, doc.data
+            return
+
+        if historic:
+            endpoint = self.couchdb_db_metadata.view("index", "historic")
+        elif source is not None:
+            endpoint = self.couchdb_db_metadata.view("index", "source")
+        else:
+            endpoint = self.couchdb_db_metadata.all_docs
+
+        if source is not None:
+            low, high = source, source
+        elif prefix is not None:
+            low, high = prefix, f"{prefix}{endpoint.prefix_sentinel}"
+        else:
+            low, high = None, None
+        start_key, end_key = (high, low) if descending else (low, high)
+
+        if after is None:
+            async for row in self._iter_view(
+                endpoint,
+                start_key,
+                end_key,
+                limit=limit,
+                page_size=page_size,
+                descending=descending,
+            ):
+                yield row["id"], row["doc"]
+            return
+
+        # The views are keyed by the metric, except for the source view. We
+        # start at `after` itself, as it may be gone by now, and drop it.
+        rows = self._iter_view(
+            endpoint,
+            source if source is not None else after,
+            end_key,
+            start_doc_id=after,
+            limit=None if limit is None else limit + 1,
+            page_size=page_size,
+            descending=descending,
+        )
+        count = 0
+        async for row in rows:
+            if row["id"] == after:
+                continue
+            if limit is not None and count >= limit:
+                return
+            count += 1
+            yield row["id"], row["doc"]
+
+    @staticmethod
+    def _page(
+        ids: Iterable[str], after: Optional[str], descending: bool
+    ) -> Iterator[str]:
+        if after is None:
+            return iter(ids)
+        if descending:
+            return (id for id in ids if id < after)
+        return (id for id in ids if id > after)
+
+    @staticmethod
+    async def _iter_view(
+        endpoint: View,
+        start_key: Optional[str],
+        end_key: Optional[str],
+        start_doc_id: Optional[str] = None,
+        limit: Optional[int] = None,
+        page_size: int = 1000,
+        descending: bool = False,
+    ) -> AsyncIterator[JsonDict]:
+        """
+        Yields the rows of a view with their documents between `start_key` and
+        `end_key`, reading `page_size` rows per request. Each page continues
+        after the last row of the previous one, so the cost of a page doesn't
+        depend on its position.
+        """
+        params: JsonDict = {"include_docs": True}
+        if descending:
+            params["descending"] = True
+        if start_key is not None:
+            params["startkey"] = json.dumps(start_key)
+        if start_doc_id is not None:
+            params["startkey_docid"] = start_doc_id
+        if end_key is not None:
+            params["endkey"] = json.dumps(end_key)
+
+        remaining = limit
+        while remaining is None or remaining > 0:
+            params["limit"] = (
+                page_size if remaining is None else min(page_size, remaining)
+            )
+            rows = (await endpoint.get(**params)).rows
+            for row in rows:
+                if "error" in row or row.get("doc") is None:
+                    continue
+                if row["id"].startswith("_design/"):
+                    # _all_docs lists the design documents, they aren't metrics
+                    continue
+                if remaining is not None:
+                    remaining -= 1
+                yield row
+
+            if len(rows) < params["limit"]:
+                break
+
+            # continue right after the last row
+            params["startkey"] = json.dumps(rows[-1]["key"])
+            params["startkey_docid"] = rows[-1]["id"]
+            params["skip"] = 1
+
     async def get_combined_metric_expression(
         self, transformer_id: str, metric: str
     ) -> Optional[Dict]:
@@ -616,46 +1331,39 @@ class Configurator(Client):
     async def create_combined_metric(
         self, transformer_id: str, metric: str, expression: Dict
     ) -> bool:
-        assert self.couchdb_db_config
-        async with self._get_config_lock(transformer_id):
-            config = await self.couchdb_db_config[transformer_id]
-
-            if config.exists:
-                await self._save_backup(config=config)
-
+        def add_metric(config: Document) -> bool:
             if "metrics" not in config:
                 config["metrics"] = {}
 
-            if metric not in config["metrics"]:
-                config["metrics"][metric] = {"expression": expression}
-                await config.save()
-                return True
+            if metric in config["metrics"]:
+                return False
 
-        return False
+            config["metrics"][metric] = {"expression": expression}
+            return True
+
+        return await self._update_config(transformer_id, add_metric, metric)
 
     async def update_combined_metric_expression(
         self, transformer_id: str, metric: str, expression: Dict, config_hash: str
     ) -> bool:
-        assert self.couchdb_db_config is not None
-        async with self._get_config_lock(transformer_id):
-            config = await self.couchdb_db_config[transformer_id]
+        def update_expression(config: Document) -> bool:
+            metric_config = config.get("metrics", {}).get(metric)
+            if metric_config is None:
+                return False
 
-            if config.exists:
-                await self._save_backup(config=config)
+            # The hash is checked against every revision we read, so if
+            # someone else changed this metric in the meantime, we fail
+            # instead of overwriting their change.
+            old_config_hash = hashlib.sha256(
+                json.dumps(metric_config).encode("utf-8")
+            ).hexdigest()
+            if config_hash != old_config_hash:
+                return False
 
-            if "metrics" not in config:
-                config["metrics"] = {}
-
-            if metric in config["metrics"]:
-                old_config_hash = hashlib.sha256(
-                    json.dumps(config["metrics"][metric]).encode("utf-8")
-                ).hexdigest()
-                if config_hash == old_config_hash:
-                    config["metrics"][metric]["expression"] = expression
-                    await config.save()
-                    return True
+            metric_config["expression"] = expression
+            return True
 
-        return False
+        return await self._update_config(transformer_id, update_expression, metric)
 
     async def discover(self) -> None:
         async def callback(from_token: str, **response):
@@ -737,126 +1445,114 @@ class Configurator(Client):
             async for client in self.couchdb_db_clients.all_docs.docs()
         ]
 
-    async def delete_metadata(self, metrics: list[str]) -> list[str]:
-        deleted_ids = []
-        # We don't want to raise an error if the metric doesn't exist, so we
-        # use the `create` parameter.
-        async for doc in self.couchdb_db_metadata.docs(metrics, create=True):
+    def mutate_metadata(
+        self, metrics: Sequence[str], mutation: Mutation
+    ) -> AsyncIterator[tuple[str, str]]:
+        """
+        Applies `mutation` to the metadata of the metrics in bulk and yields
+        the status of each metric, see :func:`mutate_docs`.
+        """
+        assert self.couchdb_db_metadata is not None
+        return mutate_docs(self.couchdb_db_metadata, metrics, mutation)
+
+    def stream_delete_metadata(
+        self, metrics: Sequence[str]
+    ) -> AsyncIterator[tuple[str, str]]:
+        def delete(doc: JsonDict) -> Optional[JsonDict]:
             if doc.get("historic", False):
-                # we don't want to delete historic metrics
-                # if we hit one, we skip it. This is also checked on
-                # the front-end, but we are thorough here.
-                continue
+                # we don't want to delete historic metrics. This is also
+                # checked on the front-end, but we are thorough here.
+                return None
+            return deleted(doc)
+
+        return self.mutate_metadata(metrics, delete)
+
+    def stream_archive_metrics(
+        self, metrics: Sequence[str]
+    ) -> AsyncIterator[tuple[str, str]]:
+        archived = str(metricq.Timestamp.now().datetime.astimezone())
+
+        def archive(doc: JsonDict) -> Optional[JsonDict]:
+            if "archived" in doc:
+                return None
+            doc["archived"] = archived
+            return doc
+
+        return self.mutate_metadata(metrics, archive)
+
+    def stream_hide_metrics(
+        self, metrics: dict[str, bool]
+    ) -> AsyncIterator[tuple[str, str]]:
+        def hide(doc: JsonDict) -> JsonDict:
+            if metrics[doc["_id"]]:
+                doc["hidden"] = True
+            else:
+                doc.pop("hidden", None)
+            return doc
 
-            if not doc.exists:
-                # if the document doesn't exist, we skip it.
-                # No actual document will be created on the server,
-                # as save() was never called.
-                continue
+        return self.mutate_metadata(list(metrics), hide)
 
-            try:
-                # we need a copy of the id, because the doc will be invalid
-                # after we call delete
-                id = doc.id
+    def stream_metrics_update_historic(
+        self, metrics: dict[str, bool]
+    ) -> AsyncIterator[tuple[str, str]]:
+        def update_historic(doc: JsonDict) -> JsonDict:
+            doc["historic"] = metrics[doc["_id"]]
+            return doc
 
-                await doc.delete()
+        return self.mutate_metadata(list(metrics), update_historic)
 
-                # delete did work, so we can add id to the list
-                deleted_ids.append(id)
-            except ConflictError:
-                # if the delete didn't work, we simply skip the error.
-                # On a logical side, this error means that the metric was declared
-                # while we try to delete it, or someone else did hit delete as well.
-                # let the frontend deal with it.
-                pass
+    # The following return the metrics, that were changed successfully. Metrics
+    # which don't exist or were changed by someone else in the meantime, e.g.
+    # re-declared, are left out. Let the frontend deal with it.
 
-        return deleted_ids
+    async def delete_metadata(self, metrics: list[str]) -> list[str]:
+        return await _succeeded(self.stream_delete_metadata(metrics))
 
     async def archive_metrics(self, metrics: list[str]) -> list[str]:
-        archived_ids = []
-        # We don't want to raise an error if the metric doesn't exist, so we
-        # use the `create` parameter.
-        async for doc in self.couchdb_db_metadata.docs(metrics, create=True):
-            if not doc.exists:
-                # if the document doesn't exist, we skip it.
-                # No actual document will be created on the server,
-                # as save() was never called.
-                continue
-
-            try:
-                if "archived" not in doc:
-                    doc["archived"] = str(metricq.Timestamp.now().datetime.astimezone())
-
-                    await doc.save()
-
-                    # saving did work, so we can add id to the list
-                    archived_ids.append(doc.id)
-            except ConflictError:
-                # if the saving didn't work, we simply skip the error.
-                # On a logical side, this error means that the metric was declared
-                # while we try to update it, or someone else did hit delete or archive as well.
-                # let the frontend deal with it.
-                pass
-
-        return archived_ids
+        return await _succeeded(self.stream_archive_metrics(metrics))
 
     async def hide_metrics(self, metrics: dict[str, bool]) -> list[str]:
-        hid_ids = []
-        assert self.couchdb_db_metadata is not None
-        # We don't want to raise an error if the metric doesn't exist, so we
-        # use the `create` parameter.
-        async for doc in self.couchdb_db_metadata.docs(list(metrics.keys()), create=True):
-            if not doc.exists:
-                # if the document doesn't exist, we skip it.
-                # No actual document will be created on the server,
-                # as save() was never called.
-                continue
-
-            try:
-                if metrics[doc.id]:
-                    doc["hidden"] = True
-                else:
-                    del doc["hidden"]
-
-                await doc.save()
-
-                # saving did work, so we can add id to the list
-                hid_ids.append(doc.id)
-            except ConflictError as e:
-                # if the saving didn't work, we simply skip the error.
-                # On a logical side, this error means that the metric was declared
-                # while we try to update it, or someone else hit delete,
-                # archive, or hide as well. let the frontend deal with it.
-                print(e)
-                pass
-
-        return hid_ids
+        return await _succeeded(self.stream_hide_metrics(metrics))
 
     async def metrics_update_historic(self, metrics: dict[str, bool]) -> list[str]:
-        updated_ids = []
-        # We don't want to raise an error if the metric doesn't exist, so we
-        # use the `create` parameter.
-        async for doc in self.couchdb_db_metadata.docs(
-            list(metrics.keys()), create=True
-        ):
-            if not doc.exists:
-                # if the document doesn't exist, we skip it.
-                # No actual document will be created on the server,
-                # as save() was never called.
-                continue
+        return await _succeeded(self.stream_metrics_update_historic(metrics))
 
-            try:
-                doc["historic"] = metrics[doc.id]
-
-                await doc.save()
-
-                # saving did work, so we can add id to the list
-                updated_ids.append(doc.id)
-            except ConflictError:
-                # if the saving didn't work, we simply skip the error.
-                # On a logical side, this error means that the metric was declared
-                # while we try to update it, or someone else tried to update it
-                # as well. Let the frontend deal with it.
-                pass
+    async def metrics_impact(self, metrics: Sequence[str]) -> JsonDict:
+        """
+        Everything that depends on the given metrics: the transformer metrics
+        computed from them, transitively, and the databases storing any of
+        them.
+        """
+        transformers = await self.transformer_index()
+        databases = await self.database_index()
+
+        requested = set(metrics)
+        affected = list(dict.fromkeys(metrics))
+        seen = set(affected)
+        dependents_by_transformer: dict[str, set[str]] = defaultdict(set)
+
+        # Breadth-first through the reverse dependencies. `affected` grows
+        # while we iterate over it.
+        for metric in affected:
+            for token, output in transformers.dependents(metric):
+                dependents_by_transformer[token].add(output)
+                if output not in seen:
+                    seen.add(output)
+                    affected.append(output)
+
+        metrics_by_database: dict[str, list[str]] = defaultdict(list)
+        for metric in affected:
+            for token in databases.databases(metric):
+                metrics_by_database[token].append(metric)
 
-        return updated_ids
+        return {
+            "dependents": sorted(seen - requested),
+            "transformers": {
+                token: sorted(outputs)
+                for token, outputs in sorted(dependents_by_transformer.items())
+            },
+            "databases": {
+                token: sorted(metrics)
+                for token, metrics in sorted(metrics_by_database.items())
+            },
+        }
@@ -0,0 +1,207 @@
+# metricq-wizard
+# Copyright (C) 2026 ZIH, CIDS, Technische Universitaet Dresden,
+#                    Federal Republic of Germany
+#
+# All rights reserved.
+#
+# This file is part of metricq-wizard.
+#
+# metricq-wizard is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# metricq-wizard is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with metricq-wizard.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Helpers for CouchDB requests, that aiocouch only offers per document.
+"""
+
+import asyncio
+from typing import Any, AsyncIterator, Callable, Iterator, Optional, Sequence, TypeVar
+
+from aiocouch import Database
+from aiocouch.event import BaseChangeEvent
+from metricq.logging import get_logger
+
+JsonDict = dict[str, Any]
+T = TypeVar("T")
+
+# Gets a copy of the current document and returns the document to write, or
+# None to leave the document alone.
+Mutation = Callable[[JsonDict], Optional[JsonDict]]
+
+logger = get_logger()
+logger.setLevel("INFO")
+
+# how long a request for the _changes feed waits for a change, in ms
+CHANGES_POLL_TIMEOUT = 60_000
+
+
+class MutationStatus:
+    """The outcome of :func:`mutate_docs` for a single document"""
+
+    OK = "ok"
+    NOT_FOUND = "not_found"
+    # the mutation decided to leave the document alone
+    SKIPPED = "skipped"
+    # the document kept changing under our hands, even after retrying
+    CONFLICT = "conflict"
+    ERROR = "error"
+
+
+def chunked(items: Sequence[T], size: int) -> Iterator[Sequence[T]]:
+    for start in range(0, len(items), size):
+        yield items[start : start + size]
+
+
+def poll_changes(
+    db: Database, since: Optional[str], **params: Any
+) -> AsyncIterator[BaseChangeEvent]:
+    """
+    The changes of `db` after the sequence `since`, as a longpoll request:
+    CouchDB answers as soon as there is a change, or after
+    ``CHANGES_POLL_TIMEOUT`` without any. Call it in a loop to follow the
+    feed without delay.
+    """
+    return db.changes(
+        since=since, feed="longpoll", timeout=CHANGES_POLL_TIMEOUT, **params
+    )
+
+
+async def bulk_docs(db: Database, docs: list[JsonDict]) -> list[JsonDict]:
+    """
+    Writes all `docs` with a single ``_bulk_docs`` request.
+
+    Returns one status object per document, in the same order. Successful
+    writes have ``ok`` and the new ``rev`` set, failed ones have ``error``
+    set, e.g. to ``conflict``.
+    """
+    if not docs:
+        return []
+    return await db._bulk_docs(docs)
+
+
+def deleted(doc: JsonDict) -> JsonDict:
+    """The stub to write with :func:`bulk_docs` to delete `doc`"""
+    return {"_id": doc["_id"], "_rev": doc["_rev"], "_deleted": True}
+
+
+_MISSING = object()
+
+
+def merge_changes(base: JsonDict, ours: JsonDict, theirs: JsonDict) -> JsonDict:
+    """
+    Merges two documents, that were both changed from the same `base`.
+
+    Changes to different keys are combined and nested objects are merged
+    key by key. Only if both sides changed the same value differently, our
+    change wins.
+    """
+    merged = {}
+    for key in dict.fromkeys([*theirs, *ours]):
+        base_value = base.get(key, _MISSING)
+        our_value = ours.get(key, _MISSING)
+        their_value = theirs.get(key, _MISSING)
+
+        if our_value == base_value:
+            value = their_value
+        elif their_value == base_value or their_value == our_value:
+            value = our_value
+        elif isinstance(our_value, dict) and isinstance(their_value, dict):
+            value = merge_changes(
+                base_value if isinstance(base_value, dict) else {},
+                our_value,
+                their_value,
+            )
+        else:
+            value = our_value
+
+        if value is not _MISSING:
+            merged[key] = value
+
+    return merged
+
+
+async def mutate_docs(
+    db: Database,
+    ids: Sequence[str],
+    mutation: Mutation,
+    chunk_size: int = 500,
+    concurrency: int = 4,
+    retries: int = 3,
+) -> AsyncIterator[tuple[str, str]]:
+    """
+    Applies `mutation` to the documents with the given `ids`.
+
+    The documents are read and written in chunks, with up to `concurrency`
+    chunks in flight. If a write conflicts, the document is read again and
+    the mutation is applied to the new revision, up to `retries` times.
+
+    Yields (id, :class:`MutationStatus`) pairs, as soon as a chunk is done.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(chunk: Sequence[str]) -> list[tuple[str, str]]:
+        async with semaphore:
+            return await _mutate_chunk(db, chunk, mutation, retries)
+
+    tasks = [
+        asyncio.create_task(run(chunk))
+        for chunk in chunked(list(dict.fromkeys(ids)), chunk_size)
+    ]
+    try:
+        for next_chunk in asyncio.as_completed(tasks):
+            for result in await next_chunk:
+                yield result
+    finally:
+        # the caller may stop listening at any time
+        for task in tasks:
+            task.cancel()
+
+
+async def _mutate_chunk(
+    db: Database, ids: Sequence[str], mutation: Mutation, retries: int
+) -> list[tuple[str, str]]:
+    results: dict[str, str] = {}
+
+    pending = list(ids)
+    for _ in range(retries + 1):
+        docs = []
+        # We don't want to raise an error if a document doesn't exist, so we
+        # use the `create` parameter. Nothing is created, as we never save.
+        async for doc in db.docs(pending, create=True):
+            if not doc.exists:
+                results[doc.id] = MutationStatus.NOT_FOUND
+                continue
+
+            new_doc = mutation(dict(doc.data))
+            if new_doc is None:
+                results[doc.id] = MutationStatus.SKIPPED
+            else:
+                docs.append(new_doc)
+
+        pending = []
+        for doc, status in zip(docs, await bulk_docs(db, docs)):
+            id = doc["_id"]
+            if "error" not in status:
+                results[id] = MutationStatus.OK
+            elif status["error"] == "conflict":
+                pending.append(id)
+            else:
+                logger.error(f"Failed to write {id}: {status['error']}")
+                results[id] = MutationStatus.ERROR
+
+        if not pending:
+            break
+
+    for id in pending:
+        results[id] = MutationStatus.CONFLICT
+
+    return list(results.items())
@@ -0,0 +1,94 @@
+# metricq-wizard
+# Copyright (C) 2026 ZIH, CIDS, Technische Universitaet Dresden,
+#                    Federal Republic of Germany
+#
+# All rights reserved.
+#
+# This file is part of metricq-wizard.
+#
+# metricq-wizard is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# metricq-wizard is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with metricq-wizard.  If not, see <http://www.gnu.org/licenses/>.
+
+from collections import defaultdict
+from typing import Any, Iterable, Optional
+
+from metricq.logging import get_logger
+
+JsonDict = dict[str, Any]
+
+DATABASE_PREFIX = "db-"
+
+logger = get_logger()
+logger.setLevel("INFO")
+
+
+class DatabaseIndex:
+    """
+    Which database stores which metric, built from the ``db-*`` configs.
+
+    Like the :class:`TransformerIndex`, it is built once and afterwards
+    updated, whenever the wizard changes one of the configs.
+    """
+
+    def __init__(self) -> None:
+        # database token => {metric => its entry in the database config}
+        self._metrics: dict[str, dict[str, JsonDict]] = {}
+        # metric => database tokens
+        self._databases: dict[str, set[str]] = defaultdict(set)
+
+    def build(self, configs: dict[str, JsonDict]) -> None:
+        self._metrics.clear()
+        self._databases.clear()
+        for token, config in configs.items():
+            self.update_config(token, config)
+
+    def update_config(self, token: str, config: Optional[JsonDict]) -> None:
+        if not token.startswith(DATABASE_PREFIX):
+            return
+
+        for metric in self._metrics.pop(token, {}):
+            databases = self._databases[metric]
+            databases.discard(token)
+            if not databases:
+                del self._databases[metric]
+
+        if config is None:
+            return
+
+        metrics = config.get("metrics", {})
+        if not isinstance(metrics, dict):
+            logger.error(
+                f"Config of database {token} is incorrect! 'metrics' is not a dict"
+            )
+            return
+
+        self._metrics[token] = dict(metrics)
+        for metric in metrics:
+            self._databases[metric].add(token)
+
+    @property
+    def database_tokens(self) -> list[str]:
+        return sorted(self._metrics)
+
+    def databases(self, metric: str) -> Iterable[str]:
+        return self._databases.get(metric, ())
+
+    def metrics(self, token: str) -> dict[str, JsonDict]:
+        return self._metrics.get(token, {})
+
+    def configurations(self, metric: str) -> list[tuple[str, JsonDict]]:
+        """The (database token, metric config) pairs of all databases of `metric`"""
+        return [
+            (token, self._metrics[token][metric])
+            for token in sorted(self.databases(metric))
+        ]
@@ -0,0 +1,108 @@
+# metricq-wizard
+# Copyright (C) 2026 ZIH, CIDS, Technische Universitaet Dresden,
+#                    Federal Republic of Germany
+#
+# All rights reserved.
+#
+# This file is part of metricq-wizard.
+#
+# metricq-wizard is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# metricq-wizard is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with metricq-wizard.  If not, see <http://www.gnu.org/licenses/>.
+
+from collections import defaultdict
+from typing import Any, Optional
+
+from .metadata_index import MetadataIndex
+from .rabbitmq import Bindings, StringTable, pair_digest
+
+_SHIFT = 32
+_MASK = (1 << _SHIFT) - 1
+_DIGEST_MASK = (1 << 64) - 1
+
+
+class DependencyWheel:
+    """
+    The number of metrics consumed by each sink and produced by each source.
+
+    The counts are built once from the metadata index and the bindings graph
+    and afterwards updated from their change notifications, so reading the
+    wheel never has to touch either of them.
+    """
+
+    def __init__(self, metadata: MetadataIndex, bindings: Bindings):
+        self.metadata = metadata
+        self.bindings = bindings
+
+        self._tokens = StringTable()
+        # (source id, sink id) packed into a single int => number of metrics
+        self._counts: dict[int, int] = defaultdict(int)
+
+        # the sum of count * pair_digest(source, sink) over all counts, so it
+        # only depends on the counts and is the same in every process
+        self._digest = 0
+        self._result: Optional[list[list[Any]]] = None
+
+        self._rebuild()
+
+        metadata.add_source_listener(self._on_source_changed)
+        bindings.add_listener(self._on_binding_changed)
+
+    @property
+    def etag(self) -> str:
+        return f'"{self._digest:016x}"'
+
+    @property
+    def result(self) -> list[list[Any]]:
+        """
+        The wheel as list of [source token, sink token, count] entries, like
+        :meth:`Configurator.fetch_dependency_wheel` returns it.
+        """
+        if self._result is None:
+            tokens = self._tokens
+            self._result = [
+                [tokens[key >> _SHIFT], tokens[key & _MASK], count]
+                for key, count in self._counts.items()
+                if count > 0
+            ]
+        return self._result
+
+    def _key(self, source: str, sink: str) -> int:
+        return self._tokens.intern(source) << _SHIFT | self._tokens.intern(sink)
+
+    def _add(self, source: Optional[str], sink: str, count: int) -> None:
+        if source is None or count == 0:
+            return
+
+        key = self._key(source, sink)
+        self._counts[key] += count
+        if self._counts[key] == 0:
+            del self._counts[key]
+
+        self._digest = (self._digest + count * pair_digest(source, sink)) & _DIGEST_MASK
+        self._result = None
+
+    def _rebuild(self) -> None:
+        self._counts.clear()
+        self._digest = 0
+        for metric, sink, count in self.bindings.items():
+            self._add(self.metadata.source(metric), sink, count)
+
+    def _on_source_changed(
+        self, metric: str, old_source: Optional[str], new_source: Optional[str]
+    ) -> None:
+        for sink, count in self.bindings.consumer_counts(metric).items():
+            self._add(old_source, sink, -count)
+            self._add(new_source, sink, count)
+
+    def _on_binding_changed(self, metric: str, sink: str, delta: int) -> None:
+        self._add(self.metadata.source(metric), sink, delta)
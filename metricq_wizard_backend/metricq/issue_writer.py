@@ -0,0 +1,165 @@
+# metricq-wizard
+# Copyright (C) 2026 ZIH, CIDS, Technische Universitaet Dresden,
+#                    Federal Republic of Germany
+#
+# All rights reserved.
+#
+# This file is part of metricq-wizard.
+#
+# metricq-wizard is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# metricq-wizard is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with metricq-wizard.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+from typing import Any, Optional
+
+from aiocouch import Database
+from metricq import Timestamp
+from metricq.logging import get_logger
+
+from .couchdb import bulk_docs, chunked
+
+JsonDict = dict[str, Any]
+
+logger = get_logger()
+logger.setLevel("INFO")
+
+# fields of an issue report, that don't make a difference for its content
+_VOLATILE_FIELDS = {"_id", "_rev", "date"}
+
+
+def _content(report: JsonDict) -> JsonDict:
+    return {key: value for key, value in report.items() if key not in _VOLATILE_FIELDS}
+
+
+class IssueReportWriter:
+    """
+    Collects the changes to the issue reports and writes them in batches.
+
+    The writer keeps a snapshot of all issue reports in the database, so it
+    can compute the change for each report without reading it first, and
+    skip writes that wouldn't change anything but the date.
+    """
+
+    def __init__(self, db: Database, batch_size: int = 500):
+        self.db = db
+        self.batch_size = batch_size
+
+        # issue id => the report as it is stored in the database
+        self.reports: dict[str, JsonDict] = {}
+        self.loaded = False
+
+        # issue id => the new report, or None if it should be deleted
+        self._pending: dict[str, Optional[JsonDict]] = {}
+        self._lock = asyncio.Lock()
+
+    async def load(self) -> None:
+        async with self._lock:
+            self.reports = {doc.id: doc.data async for doc in self.db.docs()}
+            self.loaded = True
+
+    def forget(self, id: str) -> None:
+        """Call this, when a report was deleted by other means than the writer"""
+        self.reports.pop(id, None)
+        self._pending.pop(id, None)
+
+    async def update(self, id: str, **fields: Any) -> None:
+        current = self._pending.get(id) or self.reports.get(id)
+
+        report = {} if current is None else _content(current)
+
+        if "first_detection_date" not in report:
+            # only set first_detection_date when creating the report, not
+            # on updates
+            report["first_detection_date"] = Timestamp.now().datetime.isoformat()
+
+        # entries in the new fields should overwrite existing entries
+        report.update(fields)
+
+        existing = self.reports.get(id)
+        if existing is not None and _content(existing) == report:
+            # nothing but the date would change, so leave the report alone
+            self._pending.pop(id, None)
+            return
+
+        report["date"] = Timestamp.now().datetime.isoformat()
+        self._pending[id] = report
+
+        await self._flush_if_full()
+
+    async def delete(self, id: str) -> None:
+        if id in self.reports:
+            self._pending[id] = None
+        else:
+            self._pending.pop(id, None)
+
+        await self._flush_if_full()
+
+    async def _flush_if_full(self) -> None:
+        if len(self._pending) >= self.batch_size and not self._lock.locked():
+            await self.flush()
+
+    async def flush(self) -> None:
+        async with self._lock:
+            pending, self._pending = self._pending, {}
+
+            conflicts = await self._write(pending)
+
+            if conflicts:
+                # Someone else changed these reports in the meantime, so get
+                # the current revisions and try once more.
+                async for doc in self.db.docs(list(conflicts), create=True):
+                    if doc.exists:
+                        self.reports[doc.id] = doc.data
+                    else:
+                        self.reports.pop(doc.id, None)
+
+                conflicts = await self._write(
+                    {id: pending[id] for id in conflicts if id not in self._pending}
+                )
+                if conflicts:
+                    logger.warning(
+                        f"Failed to write {len(conflicts)} issue reports due to conflicts"
+                    )
+
+    async def _write(self, pending: dict[str, Optional[JsonDict]]) -> list[str]:
+        docs = []
+        for id, report in pending.items():
+            existing = self.reports.get(id)
+            if report is None:
+                if existing is None:
+                    continue
+                docs.append({"_id": id, "_rev": existing["_rev"], "_deleted": True})
+            else:
+                doc = dict(report, _id=id)
+                if existing is not None:
+                    doc["_rev"] = existing["_rev"]
+                docs.append(doc)
+
+        conflicts = []
+        for batch in chunked(docs, self.batch_size):
+            for doc, status in zip(batch, await bulk_docs(self.db, list(batch))):
+                id = doc["_id"]
+                if "error" in status:
+                    if status["error"] == "conflict":
+                        conflicts.append(id)
+                    else:
+                        logger.error(
+                            f"Failed to write issue report {id}: {status['error']}"
+                        )
+                elif doc.get("_deleted", False):
+                    self.reports.pop(id, None)
+                else:
+                    doc["_rev"] = status["rev"]
+                    self.reports[id] = doc
+
+        return conflicts
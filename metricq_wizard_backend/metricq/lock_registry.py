@@ -0,0 +1,58 @@
+# metricq-wizard
+# Copyright (C) 2026 ZIH, CIDS, Technische Universitaet Dresden,
+#                    Federal Republic of Germany
+#
+# All rights reserved.
+#
+# This file is part of metricq-wizard.
+#
+# metricq-wizard is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# metricq-wizard is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with metricq-wizard.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+from typing import Any, Callable
+from weakref import WeakValueDictionary
+
+
+class LockRegistry:
+    """
+    A lock for each key, created on first use.
+
+    The registry holds the locks only weakly. Every coroutine that holds or
+    waits for a lock keeps a reference to it, so the lock lives exactly as
+    long as it is in use. After that, its entry disappears by itself and
+    the registry never grows beyond the number of locks in use.
+    """
+
+    def __init__(self, factory: Callable[[str], Any] = lambda key: asyncio.Lock()):
+        self.factory = factory
+        self._locks: WeakValueDictionary[str, Any] = WeakValueDictionary()
+        self.created = 0
+
+    def __len__(self) -> int:
+        return len(self._locks)
+
+    def get(self, key: str) -> Any:
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self.factory(key)
+            self._locks[key] = lock
+            self.created += 1
+        return lock
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "size": len(self._locks),
+            "locked": sum(1 for lock in list(self._locks.values()) if lock.locked()),
+            "created": self.created,
+        }
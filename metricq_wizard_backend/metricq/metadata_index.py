@@ -0,0 +1,257 @@
+# metricq-wizard
+# Copyright (C) 2026 ZIH, CIDS, Technische Universitaet Dresden,
+#                    Federal Republic of Germany
+#
+# All rights reserved.
+#
+# This file is part of metricq-wizard.
+#
+# metricq-wizard is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# metricq-wizard is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with metricq-wizard.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import re
+from collections import defaultdict
+from itertools import islice
+from typing import Any, Callable, Iterable, Optional, Sequence, Union
+
+from aiocouch import Database
+from metricq.logging import get_logger
+
+from .couchdb import poll_changes
+from .name_search import MetricNameSearch
+
+JsonDict = dict[str, Any]
+
+# called with the metric, its old source and its new source
+SourceListener = Callable[[str, Optional[str], Optional[str]], None]
+
+logger = get_logger()
+logger.setLevel("INFO")
+
+
+class MetadataIndex:
+    """
+    A resident copy of the ``metadata`` database.
+
+    The index is bootstrapped once from the database and afterwards follows
+    the ``_changes`` feed, so lookups never have to go to the CouchDB. All
+    documents handed out are shallow copies, the caller is free to modify
+    them.
+    """
+
+    def __init__(self, db: Database, retry_interval: float = 5):
+        self.db = db
+        self.retry_interval = retry_interval
+
+        self.documents: dict[str, JsonDict] = {}
+        self.metrics_by_source: dict[str, set[str]] = defaultdict(set)
+        self.historic: set[str] = set()
+        self.names = MetricNameSearch()
+
+        # the last sequence of the _changes feed, that we have seen
+        self.sequence: Optional[str] = None
+
+        self._source_listeners: list[SourceListener] = []
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def ready(self) -> bool:
+        return self.sequence is not None
+
+    async def start(self) -> None:
+        # Get the sequence before we read the documents. Changes that happen
+        # while we bootstrap will be replayed by the feed afterwards, which is
+        # fine, as applying a change is idempotent.
+        info = await self.db.info()
+        sequence = info["update_seq"]
+
+        async for doc in self.db.docs():
+            self._update(doc.id, doc.data)
+
+        self.names.build(self.documents)
+        self.sequence = sequence
+        logger.info(f"Metadata index bootstrapped with {len(self.documents)} metrics")
+
+        self._task = asyncio.create_task(self._follow())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _follow(self) -> None:
+        while True:
+            try:
+                async for event in poll_changes(
+                    self.db, self.sequence, include_docs=True
+                ):
+                    self._apply_change(event.json)
+                # the poll returned, ask right away for the next changes
+                continue
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Following the metadata _changes feed failed")
+
+            # the feed broke, so we reconnect where we left off.
+            await asyncio.sleep(self.retry_interval)
+
+    def _apply_change(self, change: JsonDict) -> None:
+        if "id" not in change:
+            # the feed also emits some bookkeeping lines, like last_seq
+            return
+
+        if not change["id"].startswith("_"):
+            if change.get("deleted", False):
+                self._update(change["id"], None)
+            else:
+                self._update(change["id"], change.get("doc"))
+
+        self.sequence = change["seq"]
+
+    def add_source_listener(self, listener: SourceListener) -> None:
+        self._source_listeners.append(listener)
+
+    def _update(self, metric: str, data: Optional[JsonDict]) -> None:
+        old = self.documents.pop(metric, None)
+        old_source = self._source_of(old)
+        new_source = self._source_of(data)
+
+        if old is not None:
+            if old_source is not None:
+                self.metrics_by_source[old_source].discard(metric)
+                if not self.metrics_by_source[old_source]:
+                    del self.metrics_by_source[old_source]
+            self.historic.discard(metric)
+
+        if data is not None:
+            self.documents[metric] = data
+
+            if new_source is not None:
+                self.metrics_by_source[new_source].add(metric)
+            if data.get("historic", False) is True:
+                self.historic.add(metric)
+
+        if old_source != new_source:
+            for listener in self._source_listeners:
+                listener(metric, old_source, new_source)
+
+        if self.ready:
+            # while bootstrapping, the names are built in one go afterwards
+            if old is None and data is not None:
+                self.names.add(metric)
+            elif old is not None and data is None:
+                self.names.remove(metric)
+
+    @staticmethod
+    def _source_of(data: Optional[JsonDict]) -> Optional[str]:
+        if data is None:
+            return None
+        source = data.get("source")
+        return source if isinstance(source, str) else None
+
+    def source(self, metric: str) -> Optional[str]:
+        return self._source_of(self.documents.get(metric))
+
+    def get(self, metric: str) -> Optional[JsonDict]:
+        data = self.documents.get(metric)
+        if data is None:
+            return None
+        return dict(data)
+
+    def produced_metrics(self, token: str) -> list[str]:
+        # The CouchDB view matches the source by prefix, we keep that behavior.
+        return sorted(
+            metric
+            for source, metrics in self.metrics_by_source.items()
+            if source.startswith(token)
+            for metric in metrics
+        )
+
+    def select(
+        self,
+        selector: Union[str, Sequence[str], None] = None,
+        historic: Optional[bool] = None,
+        prefix: Optional[str] = None,
+        infix: Optional[str] = None,
+        source: Optional[str] = None,
+        limit: Optional[int] = None,
+        after: Optional[str] = None,
+        descending: bool = False,
+    ) -> list[str]:
+        """
+        Mirrors the filtering of :meth:`Configurator.get_metrics`.
+
+        Returns the matching metric ids sorted by name. If `after` is given,
+        only those coming after it.
+        """
+        if selector is not None:
+            ids: Iterable[str]
+            if isinstance(selector, str):
+                pattern = re.compile(selector)
+                names = reversed(self.names.names) if descending else self.names.names
+                ids = (id for id in names if pattern.search(id))
+            else:
+                ids = sorted(
+                    (id for id in set(selector) if id in self.documents),
+                    reverse=descending,
+                )
+
+            if after is not None:
+                ids = (id for id in ids if (id < after if descending else id > after))
+
+            if historic is not None:
+                ids = (
+                    id
+                    for id in ids
+                    if self.documents[id].get("historic", False) == historic
+                )
+
+            return list(islice(ids, limit))
+
+        predicates: list[Callable[[str], bool]] = []
+        if historic:
+            predicates.append(self.historic.__contains__)
+
+        if source is not None:
+            if prefix is None and infix is None:
+                by_source = sorted(
+                    self.metrics_by_source.get(source, ()), reverse=descending
+                )
+                if after is not None:
+                    by_source = [
+                        id
+                        for id in by_source
+                        if (id < after if descending else id > after)
+                    ]
+                if predicates:
+                    by_source = [id for id in by_source if predicates[0](id)]
+                return by_source[:limit]
+
+            predicates.append(self.metrics_by_source.get(source, set()).__contains__)
+
+        return self.names.search(
+            prefix=prefix,
+            infix=infix,
+            predicate=(lambda id: all(p(id) for p in predicates))
+            if predicates
+            else None,
+            limit=limit,
+            after=after,
+            descending=descending,
+        )
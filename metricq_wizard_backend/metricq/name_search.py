@@ -0,0 +1,208 @@
+# metricq-wizard
+# Copyright (C) 2026 ZIH, CIDS, Technische Universitaet Dresden,
+#                    Federal Republic of Germany
+#
+# All rights reserved.
+#
+# This file is part of metricq-wizard.
+#
+# metricq-wizard is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# metricq-wizard is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with metricq-wizard.  If not, see <http://www.gnu.org/licenses/>.
+
+import heapq
+from bisect import bisect_left, bisect_right, insort
+from itertools import islice
+from typing import Callable, Iterable, Iterator, Optional
+
+# A posting is a metric name together with the offset of one of its segments.
+# The sort key of a posting is the name from that offset on, but we never
+# store that string, we only slice it during the bisection.
+Posting = tuple[str, int]
+
+
+def _posting_key(posting: Posting) -> str:
+    name, offset = posting
+    return name[offset:]
+
+
+def _segment_offsets(name: str) -> Iterator[int]:
+    # the first segment is already covered by the sorted list of names
+    offset = name.find(".")
+    while offset != -1:
+        yield offset + 1
+        offset = name.find(".", offset + 1)
+
+
+class MetricNameSearch:
+    """
+    Search structure over all metric names.
+
+    Prefix matches are answered by bisecting the sorted list of names. For
+    matches at the beginning of any other name segment, we keep a sorted list
+    of postings, one for each segment. That is the same notion of an infix as
+    the ``components`` views in the metadata database have.
+    """
+
+    def __init__(self) -> None:
+        self.names: list[str] = []
+        self._postings: list[Posting] = []
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def build(self, names: Iterable[str]) -> None:
+        self.names = sorted(names)
+        self._postings = sorted(
+            (
+                (name, offset)
+                for name in self.names
+                for offset in _segment_offsets(name)
+            ),
+            key=_posting_key,
+        )
+
+    def add(self, name: str) -> None:
+        index = bisect_left(self.names, name)
+        if index < len(self.names) and self.names[index] == name:
+            return
+
+        self.names.insert(index, name)
+        for offset in _segment_offsets(name):
+            insort(self._postings, (name, offset), key=_posting_key)
+
+    def remove(self, name: str) -> None:
+        index = bisect_left(self.names, name)
+        if index == len(self.names) or self.names[index] != name:
+            return
+
+        del self.names[index]
+        for offset in _segment_offsets(name):
+            key = name[offset:]
+            # postings with an equal key are next to each other, but may
+            # belong to other names (e.g. "a.b.c" and "x.b.c" for "b.c")
+            position = bisect_left(self._postings, key, key=_posting_key)
+            while position < len(self._postings):
+                if self._postings[position] == (name, offset):
+                    del self._postings[position]
+                    break
+                position += 1
+
+    def with_prefix(
+        self, prefix: str, after: Optional[str] = None, descending: bool = False
+    ) -> Iterator[str]:
+        """
+        All names starting with `prefix` in sorted order. If `after` is given,
+        only the names coming after it in that order.
+        """
+        names = self.names
+
+        if descending:
+            # the end of the names starting with `prefix`
+            end = bisect_right(names, prefix, key=lambda name: name[: len(prefix)])
+            if after is not None:
+                end = min(end, bisect_left(names, after))
+            for index in range(end - 1, -1, -1):
+                if not names[index].startswith(prefix):
+                    break
+                yield names[index]
+            return
+
+        start = bisect_left(names, prefix)
+        if after is not None:
+            start = max(start, bisect_right(names, after))
+        for index in range(start, len(names)):
+            if not names[index].startswith(prefix):
+                break
+            yield names[index]
+
+    def _prefix_range(self, prefix: str) -> range:
+        """The indices of the names starting with `prefix`"""
+        names = self.names
+        start = bisect_left(names, prefix)
+        end = bisect_right(
+            names, prefix, lo=start, key=lambda name: name[: len(prefix)]
+        )
+        return range(start, end)
+
+    def _segment_prefix_range(self, infix: str) -> range:
+        """The indices of the postings of segments starting with `infix`"""
+        postings = self._postings
+        start = bisect_left(postings, infix, key=_posting_key)
+        end = bisect_right(
+            postings,
+            infix,
+            lo=start,
+            key=lambda posting: posting[0][posting[1] : posting[1] + len(infix)],
+        )
+        return range(start, end)
+
+    def search(
+        self,
+        *,
+        prefix: Optional[str] = None,
+        infix: Optional[str] = None,
+        predicate: Optional[Callable[[str], bool]] = None,
+        limit: Optional[int] = None,
+        after: Optional[str] = None,
+        descending: bool = False,
+    ) -> list[str]:
+        """
+        Returns the first `limit` names in sorted order, that either start
+        with `prefix` or have a segment starting with `infix` and for which
+        `predicate` holds. Pass the last name of the previous result as
+        `after` to get the next names.
+
+        The postings of an infix aren't sorted by name. If there are only few
+        of them, we sort them, otherwise the matches are so dense, that
+        walking the sorted names finds the first `limit` of them sooner.
+        """
+        if infix is None:
+            names: Iterable[str] = self.with_prefix(prefix or "", after, descending)
+            if predicate is not None:
+                names = filter(predicate, names)
+            return list(islice(names, limit))
+
+        prefixed = self._prefix_range(infix)
+        segments = self._segment_prefix_range(infix)
+        count = len(prefixed) + len(segments)
+
+        # Walking the names, we expect a match every len(names) / count names.
+        if limit is not None and limit * len(self.names) < count * count:
+            dotted = f".{infix}"
+            names = (
+                name
+                for name in self.with_prefix("", after, descending)
+                if name.startswith(infix) or dotted in name
+            )
+            if predicate is not None:
+                names = filter(predicate, names)
+            return list(islice(names, limit))
+
+        postings = self._postings
+        matches = set(self.names[prefixed.start : prefixed.stop])
+        matches.update(postings[index][0] for index in segments)
+
+        if after is not None:
+            if descending:
+                matches = {name for name in matches if name < after}
+            else:
+                matches = {name for name in matches if name > after}
+
+        if predicate is not None:
+            matches = set(filter(predicate, matches))
+
+        if limit is None:
+            return sorted(matches, reverse=descending)
+        if descending:
+            return heapq.nlargest(limit, matches)
+        return heapq.nsmallest(limit, matches)
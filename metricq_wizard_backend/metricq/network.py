@@ -19,17 +19,41 @@
 # along with metricq-wizard.  If not, see <http://www.gnu.org/licenses/>.
 
 """
-The following code is used in the MetricQ-Explorer as backend, but it 
-has been created in the learning process. Use with care. Don't read,
-unless you intend to rewrite it.
+The lineage graph of a metric, as it is shown in the MetricQ-Explorer.
+
+The graph is explored level by level in both directions. Every level needs
+one batched metadata lookup and one read of the transformer configs, that
+haven't been seen in this search yet.
 """
 
-from collections import defaultdict
+import time
+from collections import OrderedDict, defaultdict
+from typing import TYPE_CHECKING, Any, Optional
+
+from .transformer_index import (
+    TransformerIndex,
+    is_aggregator,
+    is_combinator,
+    transformer_inputs,
+)
+
+if TYPE_CHECKING:
+    from .configurator import Configurator
+
+JsonDict = dict[str, Any]
 
 
 class Network:
-    def __init__(self, original_metric, configurator):
+    def __init__(
+        self,
+        original_metric: str,
+        configurator: "Configurator",
+        depth: Optional[int] = None,
+        transformers: Optional[TransformerIndex] = None,
+    ):
         self.configurator = configurator
+        self.depth = depth
+        self.transformers = transformers
         self.nodes = {}
         self.edges = {}
         self.layout = {}
@@ -38,6 +62,12 @@ class Network:
         self.add_layout(original_metric, 0)
         self.original_metric = original_metric
 
+        # Without the transformer index, we fall back to the transformer
+        # configs, that were read during this search.
+        self._configs: dict[str, JsonDict] = {}
+        # token => {input metric => outputs}, built once per transformer
+        self._outputs: dict[str, dict[str, list[str]]] = {}
+
     def add_metric(self, new_metric, color="#4aba4a"):
         self.nodes[new_metric] = {
             "name": new_metric,
@@ -67,100 +97,214 @@ class Network:
         self.layout[target] = {"x": x_depth * 75, "y": self.y_depth[x_depth] * 75}
         self.y_depth[x_depth] += 1
 
-    def insert_metric(self, metric: str, token: str, x_depth: int):
-        if metric not in self.nodes:
-            self.add_metric(metric)
-            self.add_layout(metric, x_depth)
-        self.add_edge(token, metric)
+    def _levels(self):
+        level = 0
+        while self.depth is None or level < self.depth:
+            yield level
+            level += 1
+
+    async def _load_configs(self, tokens: set[str]) -> None:
+        if self.transformers is not None:
+            return
+
+        missing = sorted(tokens - self._configs.keys())
+        if not missing:
+            return
+
+        configs = await self.configurator.get_configs(missing)
+        for token in missing:
+            config = configs.get(token)
+            self._configs[token] = config.get("metrics", {}) if config else {}
+
+    def _transformer_inputs(self, token: str, metric: str) -> list[str]:
+        if self.transformers is not None:
+            return self.transformers.inputs(token, metric)
+
+        config = self._configs[token].get(metric)
+        if config is None:
+            return []
+        return transformer_inputs(token, config)
+
+    def _transformer_outputs(self, token: str, metric: str) -> list[str]:
+        if self.transformers is not None:
+            return self.transformers.outputs(token, metric)
+
+        if token not in self._outputs:
+            outputs = defaultdict(list)
+            for output in self._configs[token]:
+                for input in dict.fromkeys(self._transformer_inputs(token, output)):
+                    outputs[input].append(output)
+            self._outputs[token] = outputs
+
+        return self._outputs[token].get(metric, [])
 
     async def search(self):
-        await self.search_backwards(self.original_metric, 0)
-        await self.search_forwards(self.original_metric, 0)
+        await self.search_backwards()
+        await self.search_forwards()
 
         return {"nodes": self.nodes, "edges": self.edges, "layout": self.layout}
 
-    async def search_backwards(self, metric, x_depth):
-        metadata_dict = await self.configurator.fetch_metadata([metric])
-        metadata = metadata_dict[next(iter(metadata_dict))]
-        metric_id = metadata["_id"]
-        source_token = metadata["source"]
-        if source_token not in self.nodes:
-            self.add_agent(source_token)
-            self.add_layout(source_token, x_depth - 1)
-
-        self.add_edge(source_token, metric_id)
-
-        if source_token.startswith("transformer"):
-            if source_token.endswith("combinator"):
-                await self.search_combinator_backwards(metric, source_token, x_depth)
-            elif source_token.endswith("aggregator"):
-                await self.search_aggregator_backwards(
-                    metadata["primary"], source_token, x_depth
-                )
-
-    async def search_combinator_backwards(self, metric: str, token: str, x_depth: int):
-        config = (await self.configurator.get_configs([token]))[token]["metrics"][
-            metric
-        ]
-
-        for input in self.parse_combinator_expression(config["expression"]):
-            try:
-                if input not in self.nodes:
-                    self.add_metric(input)
-                    await self.search_backwards(input, x_depth - 2)
-                    self.add_layout(input, x_depth - 2)
-                self.add_edge(input, token)
-            except Exception:
-                if input in self.nodes:
-                    del self.nodes[input]
-
-    async def search_aggregator_backwards(self, metric: str, token: str, x_depth: int):
-        if metric not in self.nodes:
-            self.add_metric(metric)
-            self.add_layout(metric, x_depth - 2)
-            await self.search_backwards(metric, x_depth - 2)
-        self.add_edge(metric, token)
-
-    async def search_forwards(self, metric, x_depth):
-        for token in await self.configurator.fetch_consumers(metric):
-            if token not in self.nodes:
-                self.add_agent(token)
-                self.add_layout(token, x_depth + 1)
-            self.add_edge(metric, token)
-
-            if token.startswith("transformer"):
-                if token.endswith("combinator"):
-                    await self.search_combinator_forwards(metric, token, x_depth)
-                elif token.endswith("aggregator"):
-                    await self.search_aggregator_forwards(metric, token, x_depth)
-
-    async def search_aggregator_forwards(self, metric: str, token: str, x_depth: int):
-        metrics = (await self.configurator.get_configs([token]))[token]["metrics"]
-
-        for aggregated_metric, config in metrics.items():
-            if metric == config["source"]:
-                self.insert_metric(aggregated_metric, token, x_depth + 2)
-                await self.search_forwards(aggregated_metric, x_depth + 2)
-
-    async def search_combinator_forwards(self, metric: str, token: str, x_depth: int):
-        metrics = (await self.configurator.get_configs([token]))[token]["metrics"]
-
-        for combined_metric, config in metrics.items():
-            if metric in self.parse_combinator_expression(config["expression"]):
-                self.insert_metric(combined_metric, token, x_depth + 2)
-                await self.search_forwards(combined_metric, x_depth + 2)
-
-    def parse_combinator_expression(self, expression, inputs=None):
-        if inputs is None:
-            inputs = []
-
-        if not isinstance(expression, dict) and not isinstance(expression, list):
-            inputs.append(expression)
-        else:
-            if isinstance(expression, dict):
-                for value in expression.values():
-                    self.parse_combinator_expression(value, inputs)
-            elif isinstance(expression, list):
-                for item in expression:
-                    self.parse_combinator_expression(item, inputs)
-        return inputs
+    async def search_backwards(self):
+        # metrics of the current level => their x position and the transformer
+        # tokens they are inputs of. The original metric has no such token.
+        frontier: dict[str, tuple[int, list[str]]] = {self.original_metric: (0, [])}
+
+        for _ in self._levels():
+            if not frontier:
+                break
+
+            metadata = await self.configurator.fetch_metadata(list(frontier))
+
+            sources: dict[str, str] = {}
+            for metric, (x_depth, consumers) in frontier.items():
+                source_token = (metadata.get(metric) or {}).get("source")
+                if not isinstance(source_token, str):
+                    if metric == self.original_metric:
+                        raise KeyError(metric)
+                    # Inputs without metadata are left out of the graph
+                    # entirely, there is nothing sensible to show for them.
+                    del self.nodes[metric]
+                    continue
+
+                if metric != self.original_metric:
+                    self.add_layout(metric, x_depth)
+                for token in consumers:
+                    self.add_edge(metric, token)
+
+                if source_token not in self.nodes:
+                    self.add_agent(source_token)
+                    self.add_layout(source_token, x_depth - 1)
+                self.add_edge(source_token, metric)
+
+                sources[metric] = source_token
+
+            await self._load_configs(
+                {
+                    token
+                    for token in sources.values()
+                    if is_combinator(token) or is_aggregator(token)
+                }
+            )
+
+            next_frontier: dict[str, tuple[int, list[str]]] = {}
+            for metric, token in sources.items():
+                if is_combinator(token):
+                    inputs = self._transformer_inputs(token, metric)
+                elif is_aggregator(token):
+                    primary = metadata[metric].get("primary")
+                    inputs = [primary] if primary is not None else []
+                else:
+                    continue
+
+                x_depth = frontier[metric][0] - 2
+                for input in inputs:
+                    if input in next_frontier:
+                        next_frontier[input][1].append(token)
+                    elif input in self.nodes:
+                        self.add_edge(input, token)
+                    else:
+                        self.add_metric(input)
+                        next_frontier[input] = (x_depth, [token])
+
+            frontier = next_frontier
+
+    async def search_forwards(self):
+        frontier: dict[str, int] = {self.original_metric: 0}
+        visited = {self.original_metric}
+
+        for _ in self._levels():
+            if not frontier:
+                break
+
+            consumers = {
+                metric: await self.configurator.fetch_consumers(metric)
+                for metric in frontier
+            }
+            await self._load_configs(
+                {
+                    token
+                    for tokens in consumers.values()
+                    for token in tokens
+                    if is_combinator(token) or is_aggregator(token)
+                }
+            )
+
+            next_frontier: dict[str, int] = {}
+            for metric, x_depth in frontier.items():
+                for token in consumers[metric]:
+                    if token not in self.nodes:
+                        self.add_agent(token)
+                        self.add_layout(token, x_depth + 1)
+                    self.add_edge(metric, token)
+
+                    if not (is_combinator(token) or is_aggregator(token)):
+                        continue
+
+                    for output in self._transformer_outputs(token, metric):
+                        if output not in self.nodes:
+                            self.add_metric(output)
+                            self.add_layout(output, x_depth + 2)
+                        self.add_edge(token, output)
+
+                        if output not in visited:
+                            visited.add(output)
+                            next_frontier[output] = x_depth + 2
+
+            frontier = next_frontier
+
+
+class LineageCache:
+    """
+    Caches the lineage graphs per (metric, depth).
+
+    An entry is only used, as long as neither the configs, the metadata nor
+    the bindings changed since it was computed. As config changes by other
+    clients than the wizard go unnoticed, entries also expire after `ttl`
+    seconds.
+    """
+
+    def __init__(
+        self, configurator: "Configurator", ttl: float = 60, max_entries: int = 1024
+    ):
+        self.configurator = configurator
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+        self._entries: OrderedDict[
+            tuple[str, Optional[int]], tuple[tuple, float, JsonDict]
+        ] = OrderedDict()
+
+    def _version(self) -> tuple:
+        configurator = self.configurator
+        index = configurator.metadata_index
+        bindings = configurator.bindings
+        return (
+            configurator.config_version,
+            index.sequence if index is not None else None,
+            bindings.snapshot_id if bindings is not None else None,
+        )
+
+    async def search(self, metric: str, depth: Optional[int] = None) -> JsonDict:
+        key = (metric, depth)
+        version = self._version()
+
+        entry = self._entries.get(key)
+        if entry is not None:
+            entry_version, created, result = entry
+            if entry_version == version and time.monotonic() - created < self.ttl:
+                self._entries.move_to_end(key)
+                return result
+
+        transformers = await self.configurator.transformer_index()
+        result = await Network(
+            metric, self.configurator, depth, transformers=transformers
+        ).search()
+
+        # Only store the result, if nothing changed while we were searching.
+        if self._version() == version:
+            self._entries[key] = (version, time.monotonic(), result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+        return result
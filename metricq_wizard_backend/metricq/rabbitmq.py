@@ -18,26 +18,464 @@
 # You should have received a copy of the GNU General Public License
 # along with metricq-wizard.  If not, see <http://www.gnu.org/licenses/>.
 
+import asyncio
+import codecs
+import hashlib
+import json
+import re
+import sys
 import urllib
-from collections import defaultdict
+from collections import Counter, defaultdict
 from contextlib import suppress
+from typing import Any, AsyncIterator, Callable, Iterable, Iterator, Optional
 
 import aiohttp
-from aiocache import SimpleMemoryCache, cached
 from aiocouch import Database, Document, NotFoundError
+from metricq.logging import get_logger
+
+from .shared_state import SharedState, SnapshotVersion
+
+logger = get_logger()
+logger.setLevel("INFO")
+
+# A binding of a metric (the routing key) to a queue (the destination), packed
+# into a single int from the ids of both strings in the StringTable.
+Binding = int
+
+_BINDING_SHIFT = 32
+_BINDING_MASK = (1 << _BINDING_SHIFT) - 1
+
+_DIGEST_MASK = (1 << 64) - 1
+
+# called with the metric, the consumer and the change of the number of bindings
+BindingListener = Callable[[str, str, int], None]
+
+_ARRAY_SEPARATORS = re.compile(r"[\s,]*")
+
+# the role of the process, that fetches the bindings for all others
+BINDINGS_LEADER = "bindings"
+# how often the other processes look for a new snapshot of the leader
+SNAPSHOT_POLL_INTERVAL = 5
+# how long requests wait for the first refresh of the bindings
+READY_TIMEOUT = 30
+
+
+class BindingsUnavailable(Exception):
+    """The bindings graph couldn't be loaded (yet)"""
+
+
+def pair_digest(first: str, second: str) -> int:
+    """
+    A 64 bit hash of the pair, which is the same in every process, unlike
+    the built-in hash(). Sums of these identify a multiset of pairs.
+    """
+    data = f"{first}\0{second}".encode()
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "little")
+
+
+class StringTable:
+    """Maps strings to small integer ids and back"""
+
+    def __init__(self) -> None:
+        self.ids: dict[str, int] = {}
+        self.strings: list[str] = []
+
+    def __len__(self) -> int:
+        return len(self.strings)
+
+    def intern(self, string: str) -> int:
+        id = self.ids.get(string)
+        if id is None:
+            id = len(self.strings)
+            string = sys.intern(string)
+            self.ids[string] = id
+            self.strings.append(string)
+        return id
+
+    def __getitem__(self, id: int) -> str:
+        return self.strings[id]
+
+    def compact(self, live: Iterable[int]) -> dict[int, int]:
+        """
+        Drops all strings but the `live` ones and returns the mapping from
+        their old to their new ids.
+        """
+        strings = self.strings
+        self.ids = {}
+        self.strings = []
+        return {id: self.intern(strings[id]) for id in sorted(live)}
+
+
+async def iter_json_array(chunks: AsyncIterator[bytes]) -> AsyncIterator[Any]:
+    """
+    Parses a JSON array incrementally and yields its elements one by one.
+
+    Only the elements themselves are decoded with the json module, so at no
+    point the whole document has to be held in memory.
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+
+    buffer = ""
+    position = 0
+    started = False
+
+    async for chunk in chunks:
+        buffer = buffer[position:] + utf8.decode(chunk)
+        position = 0
+
+        while True:
+            position = _ARRAY_SEPARATORS.match(buffer, position).end()
+            if position == len(buffer):
+                break
+
+            if not started:
+                if buffer[position] != "[":
+                    raise ValueError("Expected a JSON array")
+                started = True
+                position += 1
+                continue
+
+            if buffer[position] == "]":
+                return
+
+            try:
+                element, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                # The element is incomplete, wait for the next chunk. We only
+                # ever parse arrays of objects, which can't be a valid prefix
+                # of a longer element.
+                break
+
+            yield element
+
+    raise ValueError("Unexpected end of JSON array")
 
 
 class Bindings:
+    """
+    The bindings graph of the metricq.data exchange.
+
+    The graph is refreshed in the background. Every refresh diffs the new
+    list of bindings against the previous one, so we only have to guess the
+    tokens for queues we haven't seen yet, and for those we couldn't find a
+    client config for so far. The diff is applied without
+    yielding to the event loop, so request handlers always see a consistent
+    graph and never wait for a refresh.
+
+    With `shared` state, only the leader process fetches the bindings and
+    writes a snapshot of them. All other processes read that snapshot.
+    """
+
     def __init__(
-        self, *, api_url: str, data_host: str, configs: Database, clients: Database
+        self,
+        *,
+        api_url: str,
+        data_host: str,
+        clients: Database,
+        refresh_interval: float = 60,
+        resolve_batch_size: int = 64,
+        shared: Optional[SharedState] = None,
     ):
         self.api_url = api_url
         self.data_host = data_host
-        self.configs = configs
         self.clients = clients
+        self.refresh_interval = refresh_interval
+        self.resolve_batch_size = resolve_batch_size
+        self.shared = shared
+        # the version of the last snapshot we read as follower
+        self._snapshot_version: Optional[SnapshotVersion] = None
+        self._snapshot_written = False
+
+        self._metrics_by_consumer: dict[str, Counter[str]] = defaultdict(Counter)
+        self._consumers_by_metric: dict[str, Counter[str]] = defaultdict(Counter)
+
+        self._strings = StringTable()
+        self._bindings: set[Binding] = set()
+        self._tokens_by_queue: dict[int, str] = {}
+        # queues, whose token is only a fallback, because there was no
+        # matching client config yet
+        self._unconfirmed_queues: set[int] = set()
+
+        # incremented for every refresh that actually changed the graph
+        self.snapshot_id = 0
+        # the sum of the pair_digest of all (metric, consumer) edges
+        self._digest = 0
+        self._listeners: list[BindingListener] = []
+
+        self._ready = asyncio.Event()
+        # set once the first refresh is done, whether it worked or not
+        self._attempted = asyncio.Event()
+        self._error: Optional[Exception] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
 
-        self.metrics_by_consumer = defaultdict(list)
-        self.consumers_by_metric = defaultdict(list)
+    async def ready(self, timeout: float = READY_TIMEOUT) -> None:
+        """
+        Waits until the first refresh has completed. Raises
+        :class:`BindingsUnavailable`, if it failed or takes longer than
+        `timeout` seconds.
+        """
+        if self._ready.is_set():
+            return
+
+        try:
+            await asyncio.wait_for(self._attempted.wait(), timeout)
+        except asyncio.TimeoutError:
+            raise BindingsUnavailable(
+                "Timed out waiting for the RabbitMQ bindings"
+            ) from None
+
+        if not self._ready.is_set():
+            raise BindingsUnavailable(
+                f"Failed to load the RabbitMQ bindings: {self._error}"
+            ) from self._error
+
+    @property
+    def version(self) -> str:
+        """
+        Identifies the content of the graph. Unlike the `snapshot_id`, it is
+        the same in all processes, that see the same bindings.
+        """
+        return f"{self._digest:016x}"
+
+    def consumers(self, metric: str) -> list[str]:
+        return list(self._consumers_by_metric.get(metric, Counter()).elements())
+
+    def metrics(self, consumer: str) -> list[str]:
+        return list(self._metrics_by_consumer.get(consumer, Counter()).elements())
+
+    def consumer_counts(self, metric: str) -> Counter[str]:
+        return self._consumers_by_metric.get(metric, Counter())
+
+    def items(self) -> Iterator[tuple[str, str, int]]:
+        """All (metric, consumer, number of bindings) in the graph"""
+        for metric, consumers in self._consumers_by_metric.items():
+            for consumer, count in consumers.items():
+                yield metric, consumer, count
+
+    def add_listener(self, listener: BindingListener) -> None:
+        self._listeners.append(listener)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.refresh()
+                self._error = None
+            except asyncio.CancelledError:
+                raise
+            except BindingsUnavailable as e:
+                logger.warning(str(e))
+                self._error = e
+            except Exception as e:
+                logger.exception("Failed to refresh the RabbitMQ bindings")
+                self._error = e
+            self._attempted.set()
+
+            interval = self.refresh_interval
+            if not self._leading():
+                interval = min(interval, SNAPSHOT_POLL_INTERVAL)
+            await asyncio.sleep(interval)
+
+    def _leading(self) -> bool:
+        return self.shared is None or self.shared.try_lead(BINDINGS_LEADER)
+
+    async def refresh(self) -> None:
+        if self._leading():
+            bindings = await self._fetch()
+
+            queues = {binding & _BINDING_MASK for binding in bindings}
+            tokens, unconfirmed = await self._resolve_queues(
+                (queues - self._tokens_by_queue.keys())
+                | (queues & self._unconfirmed_queues)
+            )
+        else:
+            snapshot = await self._read_snapshot()
+            if snapshot is None:
+                if not self._ready.is_set():
+                    raise BindingsUnavailable(
+                        "There is no snapshot of the bindings leader yet"
+                    )
+                # nothing new from the leader
+                return
+            bindings, tokens = snapshot
+
+            queues = {binding & _BINDING_MASK for binding in bindings}
+            unconfirmed = set()
+
+        # From here on, we must not await anything, otherwise readers could
+        # see a half updated graph.
+        added = bindings - self._bindings
+        removed = self._bindings - bindings
+
+        # A queue may have a different token now, e.g. because its client
+        # config was created after we saw the queue first. Its bindings move
+        # from the old to the new consumer.
+        retokened = {
+            queue
+            for queue, token in tokens.items()
+            if self._tokens_by_queue.get(queue, token) != token
+        }
+        if retokened:
+            moved = {
+                binding
+                for binding in bindings & self._bindings
+                if binding & _BINDING_MASK in retokened
+            }
+            added |= moved
+            removed |= moved
+
+        for binding in removed:
+            metric = self._strings[binding >> _BINDING_SHIFT]
+            self._unlink(metric, self._tokens_by_queue[binding & _BINDING_MASK])
+
+        self._tokens_by_queue.update(tokens)
+        self._unconfirmed_queues -= tokens.keys()
+        self._unconfirmed_queues |= unconfirmed
+
+        for binding in added:
+            metric = self._strings[binding >> _BINDING_SHIFT]
+            consumer = self._tokens_by_queue[binding & _BINDING_MASK]
+            self._digest = (self._digest + pair_digest(metric, consumer)) & _DIGEST_MASK
+            self._consumers_by_metric[metric][consumer] += 1
+            self._metrics_by_consumer[consumer][metric] += 1
+            for listener in self._listeners:
+                listener(metric, consumer, 1)
+
+        self._bindings = bindings
+        for queue in self._tokens_by_queue.keys() - queues:
+            del self._tokens_by_queue[queue]
+        self._unconfirmed_queues &= queues
+        self._compact_strings()
+
+        if added or removed:
+            self.snapshot_id += 1
+            logger.info(
+                f"Updated bindings graph: {len(added)} added, {len(removed)} removed"
+            )
+
+        self._ready.set()
+
+        if self.shared is not None and self._leading():
+            if added or removed or not self._snapshot_written:
+                await self._write_snapshot()
+
+    def _compact_strings(self) -> None:
+        """
+        Frees the strings of metrics and queues, that are gone, once they
+        make up more than half of the table.
+        """
+        live = {binding >> _BINDING_SHIFT for binding in self._bindings}
+        live.update(binding & _BINDING_MASK for binding in self._bindings)
+        if len(self._strings) <= 2 * len(live):
+            return
+
+        ids = self._strings.compact(live)
+        self._bindings = {
+            ids[binding >> _BINDING_SHIFT] << _BINDING_SHIFT
+            | ids[binding & _BINDING_MASK]
+            for binding in self._bindings
+        }
+        self._tokens_by_queue = {
+            ids[queue]: token for queue, token in self._tokens_by_queue.items()
+        }
+        self._unconfirmed_queues = {ids[queue] for queue in self._unconfirmed_queues}
+
+    async def _write_snapshot(self) -> None:
+        assert self.shared is not None
+        strings = self._strings
+        await self.shared.write_snapshot(
+            BINDINGS_LEADER,
+            {
+                "bindings": [
+                    [
+                        strings[binding >> _BINDING_SHIFT],
+                        strings[binding & _BINDING_MASK],
+                    ]
+                    for binding in self._bindings
+                ],
+                "tokens": {
+                    strings[queue]: token
+                    for queue, token in self._tokens_by_queue.items()
+                },
+            },
+        )
+        self._snapshot_written = True
+
+    async def _read_snapshot(
+        self,
+    ) -> Optional[tuple[set[Binding], dict[int, str]]]:
+        """The bindings and the tokens of their queues, from the leader"""
+        assert self.shared is not None
+        snapshot = await self.shared.read_snapshot(
+            BINDINGS_LEADER, since=self._snapshot_version
+        )
+        if snapshot is None:
+            return None
+
+        self._snapshot_version, data = snapshot
+        intern = self._strings.intern
+        bindings = {
+            intern(metric) << _BINDING_SHIFT | intern(queue)
+            for metric, queue in data["bindings"]
+        }
+        tokens = {intern(queue): token for queue, token in data["tokens"].items()}
+        return bindings, tokens
+
+    def _unlink(self, metric: str, consumer: str) -> None:
+        self._digest = (self._digest - pair_digest(metric, consumer)) & _DIGEST_MASK
+
+        consumers = self._consumers_by_metric[metric]
+        consumers[consumer] -= 1
+        if consumers[consumer] <= 0:
+            del consumers[consumer]
+            if not consumers:
+                del self._consumers_by_metric[metric]
+
+        metrics = self._metrics_by_consumer[consumer]
+        metrics[metric] -= 1
+        if metrics[metric] <= 0:
+            del metrics[metric]
+            if not metrics:
+                del self._metrics_by_consumer[consumer]
+
+        for listener in self._listeners:
+            listener(metric, consumer, -1)
+
+    async def _resolve_queues(
+        self, queues: set[int]
+    ) -> tuple[dict[int, str], set[int]]:
+        """
+        The tokens of the consumers of the `queues`, and the queues for which
+        there was no matching client config, so their token is just a guess.
+        """
+        tokens: dict[int, str] = {}
+        unconfirmed: set[int] = set()
+
+        pending = list(queues)
+        for start in range(0, len(pending), self.resolve_batch_size):
+            batch = pending[start : start + self.resolve_batch_size]
+            guesses = await asyncio.gather(
+                *[
+                    self._guess_token_from_queue_name(self._strings[queue])
+                    for queue in batch
+                ]
+            )
+            for queue, (token, confirmed) in zip(batch, guesses):
+                tokens[queue] = token
+                if not confirmed:
+                    unconfirmed.add(queue)
+
+        return tokens, unconfirmed
 
     async def _client_exists(self, token: str) -> bool:
         with suppress(NotFoundError):
@@ -48,22 +486,22 @@ class Bindings:
             return True
         return False
 
-    @cached(ttl=5 * 60, cache=SimpleMemoryCache)
-    async def _guess_token_from_queue_name(self, queue: str) -> str:
+    async def _guess_token_from_queue_name(self, queue: str) -> tuple[str, bool]:
+        """The token and whether there is a client config for it"""
         # first check if it's a data queue
         # somehow vtti managed to add a data queue without the
         # postfix, so I make vtti proud by replacing the assert with
         # an if statement.
         if not queue.endswith("-data"):
             # whatever this queue is, but I blame vtti for it.
-            return queue
+            return queue, True
 
         token = queue.removesuffix("-data")
 
         # assume the queue name is in the format of {token}-data
         # check if there is a configuration for a document called {token}
         if await self._client_exists(token):
-            return token
+            return token, True
 
         # maybe the queue got a uuid attached to it
         # so it would be in the format {token}-{uuid}-data
@@ -74,13 +512,13 @@ class Bindings:
             token = token.rsplit("-", 1)[0]
 
             if await self._client_exists(token):
-                return token
+                return token, True
 
         # I don't know what this is, but it's a queue ¯\_(ツ)_/¯
         # so we just return the original queue name w/o the -data suffix
-        return queue.removesuffix("-data")
+        return queue.removesuffix("-data"), False
 
-    async def _fetch(self):
+    async def _fetch(self) -> set[Binding]:
         async with aiohttp.ClientSession() as session:
             async with session.get(
                 urllib.parse.urljoin(
@@ -89,21 +527,14 @@ class Bindings:
                 ),
                 raise_for_status=True,
             ) as resp:
-                for binding in await resp.json():
-                    metric = binding["routing_key"]
-                    consumer = await self._guess_token_from_queue_name(
-                        binding["destination"]
+                # The response easily gets a few hundred MB for large data
+                # hosts, so we parse it while it is downloaded and only keep
+                # the ids of the two strings we care about.
+                intern = self._strings.intern
+                return {
+                    intern(binding["routing_key"]) << _BINDING_SHIFT
+                    | intern(binding["destination"])
+                    async for binding in iter_json_array(
+                        resp.content.iter_chunked(64 * 1024)
                     )
-                    self.consumers_by_metric[metric].append(consumer)
-                    self.metrics_by_consumer[consumer].append(metric)
-
-
-async def fetch_bindings(
-    *, api_url: str, data_host: str, configs: Database, clients: Database
-) -> Bindings:
-    bindings = Bindings(
-        api_url=api_url, data_host=data_host, configs=configs, clients=clients
-    )
-    await bindings._fetch()
-
-    return bindings
+                }
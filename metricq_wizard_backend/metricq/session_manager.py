@@ -17,7 +17,8 @@
 #
 # You should have received a copy of the GNU General Public License
 # along with metricq-wizard.  If not, see <http://www.gnu.org/licenses/>.
-from typing import Dict
+import time
+from collections import OrderedDict
 
 from metricq import get_logger
 
@@ -27,14 +28,57 @@ logger = get_logger()
 
 
 class UserSessionManager:
-    def __init__(self):
-        self._user_sessions: Dict[str, UserSession] = {}
+    """
+    The sessions of all users, least recently used first.
+
+    Sessions expire `ttl` seconds after their last use. If there are more
+    than `max_sessions`, the least recently used ones are dropped early.
+    """
+
+    def __init__(self, ttl: float = 3600, max_sessions: int = 1000):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+
+        # session key => (time of last use, session)
+        self._user_sessions: OrderedDict[str, tuple[float, UserSession]] = OrderedDict()
+        self.expired = 0
+        self.evicted = 0
+
+    def __len__(self) -> int:
+        return len(self._user_sessions)
 
     def get_user_session(self, session_key) -> UserSession:
-        session = self._user_sessions.get(session_key)
+        now = time.monotonic()
+        self._expire(now)
 
-        if session is None:
+        entry = self._user_sessions.pop(session_key, None)
+        if entry is None:
             session = UserSession(session_key=session_key)
-            self._user_sessions[session_key] = session
+        else:
+            _, session = entry
+        self._user_sessions[session_key] = (now, session)
+
+        while len(self._user_sessions) > self.max_sessions:
+            self._user_sessions.popitem(last=False)
+            self.evicted += 1
+            logger.info("Dropped the least recently used session")
 
         return session
+
+    def _expire(self, now: float) -> None:
+        while self._user_sessions:
+            key, (last_used, _) = next(iter(self._user_sessions.items()))
+            if now - last_used < self.ttl:
+                break
+            del self._user_sessions[key]
+            self.expired += 1
+
+    def stats(self) -> dict[str, float]:
+        self._expire(time.monotonic())
+        return {
+            "size": len(self._user_sessions),
+            "max_size": self.max_sessions,
+            "ttl": self.ttl,
+            "expired": self.expired,
+            "evicted": self.evicted,
+        }
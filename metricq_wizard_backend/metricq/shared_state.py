@@ -0,0 +1,194 @@
+# metricq-wizard
+# Copyright (C) 2026 ZIH, CIDS, Technische Universitaet Dresden,
+#                    Federal Republic of Germany
+#
+# All rights reserved.
+#
+# This file is part of metricq-wizard.
+#
+# metricq-wizard is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# metricq-wizard is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with metricq-wizard.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+State shared by several wizard processes on the same host, e.g. the workers
+of gunicorn. Everything goes through files in a common directory, so there
+is no extra process to run.
+"""
+
+import asyncio
+import fcntl
+import hashlib
+import json
+import os
+import tempfile
+from pathlib import Path
+from typing import Any, Optional
+
+from metricq.logging import get_logger
+
+logger = get_logger()
+logger.setLevel("INFO")
+
+# identifies the version of a snapshot file: (inode, modification time)
+SnapshotVersion = tuple[int, int]
+
+
+def _file_name(name: str, suffix: str) -> str:
+    # names are tokens, which may contain anything a file name must not
+    return hashlib.sha1(name.encode()).hexdigest() + suffix
+
+
+class FileLock:
+    """
+    A lock, that excludes other coroutines of this process like an
+    :class:`asyncio.Lock` and other processes with ``flock``.
+
+    The file lock is taken without blocking, and retried with a growing
+    delay, so waiting for it never blocks the event loop.
+    """
+
+    def __init__(self, path: Path, max_delay: float = 0.05):
+        self.path = path
+        self.max_delay = max_delay
+        self._lock = asyncio.Lock()
+        self._fd: Optional[int] = None
+
+    def locked(self) -> bool:
+        return self._lock.locked()
+
+    async def acquire(self) -> None:
+        await self._lock.acquire()
+
+        fd = None
+        try:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            delay = 0.001
+            while True:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    await asyncio.sleep(delay)
+                    delay = min(2 * delay, self.max_delay)
+        except BaseException:
+            if fd is not None:
+                os.close(fd)
+            self._lock.release()
+            raise
+
+        self._fd = fd
+
+    def release(self) -> None:
+        assert self._fd is not None
+        fcntl.flock(self._fd, fcntl.LOCK_UN)
+        os.close(self._fd)
+        self._fd = None
+        self._lock.release()
+
+    async def __aenter__(self) -> None:
+        await self.acquire()
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        self.release()
+
+
+class SharedState:
+    """
+    Locks, leader election and snapshots in `directory`, which all processes
+    must share.
+
+    A leader is the process holding the ``flock`` of its role. When it
+    exits, the lock is released by the kernel and the next process asking
+    takes over.
+    """
+
+    def __init__(self, directory: str | Path):
+        self.directory = Path(directory)
+        self._locks = self.directory / "locks"
+        self._locks.mkdir(parents=True, exist_ok=True)
+
+        # role => file descriptor of the lock we hold as leader
+        self._leader_fds: dict[str, int] = {}
+
+    def lock(self, name: str) -> FileLock:
+        return FileLock(self._locks / _file_name(name, ".lock"))
+
+    def try_lead(self, role: str) -> bool:
+        """
+        Whether this process is the leader for `role`. Becomes the leader,
+        if there is none.
+        """
+        if role in self._leader_fds:
+            return True
+
+        fd = os.open(
+            self.directory / _file_name(role, ".leader"), os.O_RDWR | os.O_CREAT, 0o644
+        )
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+
+        logger.info(f"Process {os.getpid()} is now the leader for {role}")
+        self._leader_fds[role] = fd
+        return True
+
+    def close(self) -> None:
+        """Gives up all roles, so another process can take over"""
+        for fd in self._leader_fds.values():
+            os.close(fd)
+        self._leader_fds.clear()
+
+    def _snapshot_path(self, name: str) -> Path:
+        return self.directory / f"{name}.snapshot.json"
+
+    async def write_snapshot(self, name: str, data: Any) -> None:
+        """Replaces the snapshot atomically, readers never see half of it"""
+        path = self._snapshot_path(name)
+
+        def write() -> None:
+            fd, temporary = tempfile.mkstemp(dir=self.directory, prefix=f".{name}.")
+            try:
+                with os.fdopen(fd, "w") as file:
+                    json.dump(data, file)
+                os.replace(temporary, path)
+            except BaseException:
+                os.unlink(temporary)
+                raise
+
+        await asyncio.to_thread(write)
+
+    async def read_snapshot(
+        self, name: str, since: Optional[SnapshotVersion] = None
+    ) -> Optional[tuple[SnapshotVersion, Any]]:
+        """
+        The version and content of the snapshot, or None if there is none,
+        or if it is still the version `since`.
+        """
+        path = self._snapshot_path(name)
+
+        def read() -> Optional[tuple[SnapshotVersion, Any]]:
+            try:
+                with open(path) as file:
+                    # the version of the file we actually read, it may have
+                    # been replaced since we opened it
+                    stat = os.fstat(file.fileno())
+                    version = (stat.st_ino, stat.st_mtime_ns)
+                    if version == since:
+                        return None
+                    return version, json.load(file)
+            except FileNotFoundError:
+                return None
+
+        return await asyncio.to_thread(read)
@@ -0,0 +1,148 @@
+# metricq-wizard
+# Copyright (C) 2026 ZIH, CIDS, Technische Universitaet Dresden,
+#                    Federal Republic of Germany
+#
+# All rights reserved.
+#
+# This file is part of metricq-wizard.
+#
+# metricq-wizard is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# metricq-wizard is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with metricq-wizard.  If not, see <http://www.gnu.org/licenses/>.
+
+from collections import defaultdict
+from typing import Any, Iterable, Optional
+
+JsonDict = dict[str, Any]
+
+TRANSFORMER_PREFIX = "transformer-"
+
+
+def is_combinator(token: str) -> bool:
+    return token.startswith("transformer") and token.endswith("combinator")
+
+
+def is_aggregator(token: str) -> bool:
+    return token.startswith("transformer") and token.endswith("aggregator")
+
+
+def parse_combinator_expression(expression, inputs=None):
+    if inputs is None:
+        inputs = []
+
+    if not isinstance(expression, dict) and not isinstance(expression, list):
+        inputs.append(expression)
+    else:
+        if isinstance(expression, dict):
+            for value in expression.values():
+                parse_combinator_expression(value, inputs)
+        elif isinstance(expression, list):
+            for item in expression:
+                parse_combinator_expression(item, inputs)
+    return inputs
+
+
+def transformer_inputs(token: str, metric_config: JsonDict) -> list[str]:
+    """The input metrics of a single metric in the config of a transformer"""
+    if is_aggregator(token):
+        source = metric_config.get("source")
+        return [source] if isinstance(source, str) else []
+
+    if is_combinator(token):
+        return [
+            input
+            for input in parse_combinator_expression(metric_config.get("expression"))
+            if isinstance(input, str)
+        ]
+
+    return []
+
+
+class TransformerIndex:
+    """
+    The reverse dependencies of all combinators and aggregators.
+
+    Maps each input metric to the transformer metrics computed from it. The
+    index is built once from all ``transformer-*`` configs and afterwards
+    updated, whenever the wizard changes one of them.
+    """
+
+    def __init__(self) -> None:
+        # input metric => {(transformer token, output metric)}
+        self._dependents: dict[str, set[tuple[str, str]]] = defaultdict(set)
+        # (transformer token, output metric) => input metrics
+        self._inputs: dict[tuple[str, str], tuple[str, ...]] = {}
+        # transformer token => its metrics, that have inputs
+        self._metrics_by_token: dict[str, set[str]] = defaultdict(set)
+
+    def build(self, configs: dict[str, JsonDict]) -> None:
+        self._dependents.clear()
+        self._inputs.clear()
+        self._metrics_by_token.clear()
+        for token, config in configs.items():
+            self.update_config(token, config)
+
+    def __len__(self) -> int:
+        return len(self._inputs)
+
+    def update_config(self, token: str, config: Optional[JsonDict]) -> None:
+        """Replaces everything we know about the transformer with `config`"""
+        if not token.startswith(TRANSFORMER_PREFIX):
+            return
+
+        metrics = (config or {}).get("metrics") or {}
+        for output in list(self._metrics_by_token.get(token, ())):
+            if output not in metrics:
+                self.update_metric(token, output, None)
+
+        for output, metric_config in metrics.items():
+            self.update_metric(token, output, metric_config)
+
+    def update_metric(
+        self, token: str, metric: str, metric_config: Optional[JsonDict]
+    ) -> None:
+        key = (token, metric)
+
+        for input in self._inputs.pop(key, ()):
+            dependents = self._dependents[input]
+            dependents.discard(key)
+            if not dependents:
+                del self._dependents[input]
+
+        metrics = self._metrics_by_token[token]
+        metrics.discard(metric)
+
+        if isinstance(metric_config, dict):
+            inputs = tuple(dict.fromkeys(transformer_inputs(token, metric_config)))
+            if inputs:
+                self._inputs[key] = inputs
+                metrics.add(metric)
+                for input in inputs:
+                    self._dependents[input].add(key)
+
+        if not metrics:
+            del self._metrics_by_token[token]
+
+    def dependents(self, metric: str) -> Iterable[tuple[str, str]]:
+        """All (transformer token, output metric) pairs, that use `metric`"""
+        return self._dependents.get(metric, ())
+
+    def outputs(self, token: str, metric: str) -> list[str]:
+        """The metrics of transformer `token`, that use `metric` as input"""
+        return sorted(
+            output
+            for dependent_token, output in self.dependents(metric)
+            if dependent_token == token
+        )
+
+    def inputs(self, token: str, metric: str) -> list[str]:
+        return list(self._inputs.get((token, metric), ()))
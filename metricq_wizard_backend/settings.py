@@ -1,3 +1,5 @@
+from typing import Optional
+
 from cryptography.fernet import Fernet
 from pydantic import AnyHttpUrl, BaseSettings, stricturl
 
@@ -21,6 +23,32 @@ class Settings(BaseSettings):
     rabbitmq_data_host: str = "/"
     dry_run = False
     metric_scanner_ignore_patterns: list[str] = []
+    # limits for the history requests of the health scan, for each database
+    metric_scanner_max_concurrency_per_database: int = 32
+    metric_scanner_rate_per_database: float = 100
+    metric_scanner_target_latency: float = 5
+    # check metrics continuously as their metadata changes
+    metric_scanner_incremental: bool = False
+    # the budget of liveness checks per second for the incremental scan
+    metric_scanner_checks_per_second: float = 50
+    # keep a copy of the metadata database in memory, see MetadataIndex
+    metadata_index: bool = True
+    # keep a copy of the config database in memory, see ConfigCache
+    config_cache: bool = True
+    # seconds between two refreshes of the RabbitMQ bindings graph
+    bindings_refresh_interval: float = 60
+    # limits of the cache for compressed responses, see ResponseCache
+    response_cache_max_entries: int = 256
+    response_cache_max_bytes: int = 64 * 1024 * 1024
+    # a directory shared by all worker processes on this host, enables the
+    # shared-state mode for several workers, see README.md
+    shared_state_dir: Optional[str] = None
+    # seconds until an unused session of the source config editor expires,
+    # and the number of sessions kept at most
+    session_ttl: float = 3600
+    max_sessions: int = 1000
+    # the JSON encoder of the API responses: "auto", "orjson" or "json"
+    json_encoder: str = "auto"
 
     class Config:
         env_file = ".env"